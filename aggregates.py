@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_store import DATA_PATH, data_version, load_dataframe
+from schema import PARTICIPANT_COLUMNS, SENSOR_COLUMNS
+
+STATS = ['mean', 'min', 'max', 'count', 'std']
+
+# flattened "<variable>|<stat>" column names, Parquet needs plain string columns
+SEPARATOR = '|'
+
+logger = logging.getLogger(__name__)
+
+# data_version() of the data a derived table was built from, stored in its Parquet metadata
+VERSION_KEY = b'studentlife.data_version'
+
+# derived tables that could not be written next to the data, keyed on the data version
+_unsaved = {}
+_lock = threading.Lock()
+
+
+def build_daily_cube(frame, by_id=False):
+    """Return mean/min/max/count/std of every sensor column per date (and `id`).
+
+    The result is indexed by date (or by date and id) and has (variable, stat)
+    columns, computed in a single grouped pass over `frame`.
+    """
+    keys = ['date', 'id'] if by_id else ['date']
+    columns = [col for col in SENSOR_COLUMNS if col in frame.columns]
+    return frame.groupby(keys, observed=True, sort=True)[columns].agg(STATS)
+
+
+def merge_daily_cubes(old, new):
+    """Combine two daily cubes as if they were built from the union of their rows."""
+    keys = old.index.union(new.index)
+    old, new = old.reindex(keys), new.reindex(keys)
+    merged = {}
+    for col in old.columns.get_level_values(0).unique():
+        a, b = old[col], new[col]
+        n_a, n_b = a['count'].fillna(0), b['count'].fillna(0)
+        count = n_a + n_b
+        mean = (a['mean'].fillna(0) * n_a + b['mean'].fillna(0) * n_b) / count.where(count > 0)
+        # pooled sum of squared deviations, std is the sample (ddof=1) one like pandas'
+        m2 = ((a['std'].fillna(0) ** 2) * (n_a - 1).clip(lower=0) + (b['std'].fillna(0) ** 2) * (n_b - 1).clip(lower=0)
+              + (b['mean'] - a['mean']).fillna(0) ** 2 * n_a * n_b / count.where(count > 0))
+        merged[col] = pd.DataFrame({
+            'mean': mean,
+            'min': pd.concat([a['min'], b['min']], axis=1).min(axis=1),
+            'max': pd.concat([a['max'], b['max']], axis=1).max(axis=1),
+            'count': count.astype('int64'),
+            'std': (m2 / (count - 1).where(count > 1)) ** 0.5,
+        })[STATS]
+    return pd.concat(merged, axis=1)
+
+
+def cube_path(by_id=False, path=DATA_PATH):
+    return path + ('.daily_by_id.parquet' if by_id else '.daily.parquet')
+
+
+def _write_table(frame, dst, version=None):
+    table = pa.Table.from_pandas(frame)
+    if version is not None:
+        table = table.replace_schema_metadata({**table.schema.metadata, VERSION_KEY: version.encode('utf-8')})
+    tmp = dst + '.tmp'
+    pq.write_table(table, tmp)
+    os.replace(tmp, dst)
+    return dst
+
+
+def write_daily_cube(cube, dst, version=None):
+    """Write `cube` to `dst`, stamped as built from the data of data_version() `version` if given."""
+    flat = cube.copy()
+    flat.columns = [SEPARATOR.join(col) for col in cube.columns]
+    return _write_table(flat, dst, version)
+
+
+def _unflatten(flat):
+    if isinstance(flat.columns, pd.MultiIndex):
+        return flat
+    flat.columns = pd.MultiIndex.from_tuples([tuple(col.split(SEPARATOR)) for col in flat.columns])
+    return flat
+
+
+def read_daily_cube(src):
+    return _unflatten(pd.read_parquet(src, engine='pyarrow'))
+
+
+def _is_current(dst, path, version=None):
+    # built from exactly the data at `path` (pickle and appended partitions), whatever the files' mtimes
+    if not os.path.exists(dst):
+        return False
+    metadata = pq.read_schema(dst).metadata or {}
+    return metadata.get(VERSION_KEY) == (version or data_version(path)).encode('utf-8')
+
+
+def is_cube_current(by_id=False, path=DATA_PATH):
+    return _is_current(cube_path(by_id, path), path)
+
+
+def _load_derived(dst, path, build, write):
+    # return the table stored at `dst`, rebuilding it when the data at `path` changed
+    version = data_version(path)
+    with _lock:
+        if not _is_current(dst, path, version):
+            unsaved = _unsaved.get(dst)
+            if unsaved is not None and unsaved[0] == version:
+                return unsaved[1].copy(deep=False)
+            table = build()
+            try:
+                write(table, dst, version)
+            except OSError:
+                # read-only data directory: keep the table in memory instead
+                _unsaved[dst] = (version, table)
+                return table.copy(deep=False)
+    return load_dataframe(path=dst)
+
+
+def load_daily_cube(by_id=False, path=DATA_PATH):
+    """Return the daily aggregate cube of the frame at `path`.
+
+    The cube is stored next to the data and rebuilt, from the sensor columns
+    only, whenever the data file or its appended partitions changed since it was built.
+    """
+    def build():
+        return build_daily_cube(load_dataframe(['date', 'id'] + SENSOR_COLUMNS, path=path), by_id)
+    return _unflatten(_load_derived(cube_path(by_id, path), path, build, write_daily_cube))
+
+
+def build_participant_table(frame):
+    """Return one row per participant `id` with its PARTICIPANT_COLUMNS.
+
+    These columns repeat on every daily row of a participant; the first
+    non-missing value is kept and participants with conflicting values are logged.
+    """
+    columns = [col for col in PARTICIPANT_COLUMNS if col in frame.columns]
+    grouped = frame.groupby('id', observed=True)[columns]
+    conflicts = grouped.nunique().gt(1)
+    if conflicts.any(axis=None):
+        logger.warning("participant columns differ between days of the same id: %s",
+                       {col: list(conflicts.index[conflicts[col]]) for col in columns if conflicts[col].any()})
+    table = grouped.first()
+    table.index = table.index.astype('int64')
+    return table
+
+
+def merge_participant_tables(old, new):
+    """Add the participants of `new` to `old`; ids already in `old` keep their values."""
+    return old.combine_first(new).sort_index()
+
+
+def participant_path(path=DATA_PATH):
+    return path + '.participants.parquet'
+
+
+def write_participant_table(table, dst, version=None):
+    """Write `table` to `dst`, stamped as built from the data of data_version() `version` if given."""
+    return _write_table(table, dst, version)
+
+
+def is_participant_table_current(path=DATA_PATH):
+    return _is_current(participant_path(path), path)
+
+
+def load_participant_table(path=DATA_PATH):
+    """Return the participant table (trait and other per-participant scores) of the frame at `path`."""
+    def build():
+        return build_participant_table(load_dataframe(['id'] + PARTICIPANT_COLUMNS, path=path))
+    return _load_derived(participant_path(path), path, build, write_participant_table)
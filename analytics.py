@@ -0,0 +1,122 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from data_store import freeze
+
+MAX_MEMOIZED = 256
+
+# PANAS self-report columns and their chart labels
+PANAS_COLUMNS = {'label_panas_PA': 'Positive Affect', 'label_panas_NA': 'Negative Affect'}
+
+TRAIT_COLUMNS = ['label_extraversion', 'label_agreeableness', 'label_conscientiousness',
+                 'label_neuroticism', 'label_openness', 'label_loneliness']
+
+# (function, version, arguments) -> frozen result, least recently used first
+_results = OrderedDict()
+_lock = threading.Lock()
+
+
+def _fingerprint(value):
+    # frames are identified by the caller's version token, not by their content
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return 'frame'
+    if isinstance(value, (list, tuple)):
+        return tuple(_fingerprint(v) for v in value)
+    return value
+
+
+def _shallow_copy(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy(deep=False)
+    return result
+
+
+def memoize(func):
+    """Cache the results of `func` keyed on a `version` keyword argument and its other arguments.
+
+    `version` is a hashable token that changes whenever the content of the frame
+    arguments does, e.g. data_store.data_version() plus whatever selected the
+    rows; the frames themselves are not hashed. Calls without a version are
+    computed and not cached. Results are shared between callers (and sessions),
+    so they are stored read-only like load_dataframe's frames and every call
+    gets its own shallow copy.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, version=None, **kwargs):
+        if version is None:
+            return func(*args, **kwargs)
+        key = (func.__name__, version, _fingerprint(args), _fingerprint(tuple(sorted(kwargs.items()))))
+        with _lock:
+            if key in _results:
+                _results.move_to_end(key)
+                return _shallow_copy(_results[key])
+        result = func(*args, **kwargs)
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            result = freeze(result)
+        with _lock:
+            _results[key] = result
+            while len(_results) > MAX_MEMOIZED:
+                _results.popitem(last=False)
+        return _shallow_copy(result)
+    return wrapper
+
+
+@memoize
+def daily_series(cube, variable, stat='mean'):
+    """Return one statistic of `variable` per date from a daily cube, named after the variable."""
+    return cube[variable][stat].rename(variable)
+
+
+@memoize
+def overall_mean(cube, variable):
+    """Return the mean of `variable` over all rows, recovered from the daily means and counts."""
+    daily = cube[variable]
+    return (daily['mean'] * daily['count']).sum() / daily['count'].sum()
+
+
+@memoize
+def daily_means_long(cube, variables, var_name='variable', value_name='value'):
+    """Return the daily means of `variables` as a long (date, var_name, value_name) frame."""
+    means = pd.DataFrame({variable: cube[variable]['mean'] for variable in variables})
+    return means.reset_index().melt(id_vars=['date'], value_vars=list(variables),
+                                    var_name=var_name, value_name=value_name)
+
+
+@memoize
+def weekday_profile(frame, columns, quantiles=(), counts=False):
+    """Return the mean, min and max of `columns` per day of the week, in one grouped pass.
+
+    The result has one row per (variable, DayName), Monday first, so its size is
+    7 x len(columns) whatever the number of rows of `frame`. `quantiles` adds a
+    qNN column per quantile (e.g. 0.25 -> q25) and `counts` the number of values.
+    """
+    stats = ['mean', 'min', 'max'] + (['count'] if counts else [])
+    grouped = frame.groupby('DayName', observed=False)[list(columns)]
+    profile = grouped.agg(stats)
+    if quantiles:
+        bands = grouped.quantile(list(quantiles)).unstack()
+        bands.columns = pd.MultiIndex.from_tuples([(col, f"q{round(q * 100):02d}") for col, q in bands.columns])
+        profile = profile.join(bands)
+    return pd.concat({col: profile[col] for col in columns}, names=['variable']).reset_index()
+
+
+@memoize
+def participant_daily_long(rows, columns):
+    """Return the daily mean of `columns` per participant of `rows` as (id, date, variable, value) rows."""
+    daily = rows.groupby(['id', 'date'], observed=True)[list(columns)].mean().reset_index()
+    return daily.melt(id_vars=['id', 'date'], value_vars=list(columns), var_name='variable', value_name='value')
+
+
+@memoize
+def trait_scores_long(participants, columns=tuple(TRAIT_COLUMNS)):
+    """Return the trait `columns` of the participant table melted to (id, variable, value).
+
+    `participants` is indexed by id (see aggregates.load_participant_table), so
+    there is one row per participant and trait; the label_ prefix is dropped.
+    """
+    renamed = participants[list(columns)].rename_axis('id').reset_index()
+    renamed = renamed.rename(columns=lambda col: col.replace('label_', ''))
+    return renamed.melt(id_vars=['id'], value_vars=[col.replace('label_', '') for col in columns])
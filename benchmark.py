@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import analytics
+from aggregates import build_daily_cube, build_participant_table
+from correlations import CorrelationEngine
+from data_store import DATA_PATH, load_dataframe
+from export import write_export
+from table_query import TableIndex
+
+HISTORY_PATH = 'benchmarks/history.jsonl'
+
+# a step is reported as a regression when it is this much slower than the median of its last
+# HISTORY_WINDOW runs at the same scale and repeat count, and slower by at least MIN_REGRESSION_SECONDS
+REGRESSION_RATIO = 1.25
+HISTORY_WINDOW = 5
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def scale_frame(frame, factor):
+    """Return `frame` repeated to about `factor` times its size, in participants and days.
+
+    Participants are copied under new ids and the copies are shifted by whole
+    study periods, so the result has ~sqrt(factor) times the ids and the days.
+    """
+    if factor == 1:
+        return frame
+    id_copies = max(1, int(round(np.sqrt(factor))))
+    day_copies = max(1, factor // id_copies)
+    ids = frame['id'].astype('int64')
+    id_span = int(ids.max()) + 1
+    day_span = (frame['date'].max() - frame['date'].min()).days + 1
+    copies = []
+    for i in range(id_copies):
+        for j in range(day_copies):
+            copy = frame.copy()
+            copy['id'] = ids + i * id_span
+            copy['date'] = frame['date'] + pd.Timedelta(days=j * day_span)
+            copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def page_steps(path):
+    """Return the (name, callable) data-preparation steps of every page, run in order.
+
+    Analytics functions are called unmemoized, so every run measures the computation.
+    """
+    state = {}
+
+    def cold_load():
+        # the compact copy written by the first load would turn later repeats into memory-mapping only
+        shutil.rmtree(path + '.compact', ignore_errors=True)
+        data_store.clear_cache()
+        state['df'] = load_dataframe(path=path)
+
+    def table_page():
+        rows = TableIndex(state['df']).select(sort_by='date')
+        return rows.iloc[:50]
+
+    def csv_export():
+        write_export(state['df'], 'csv', io.BytesIO())
+
+    def daily_cube():
+        state['cube'] = build_daily_cube(state['df'])
+
+    def behavior_patterns():
+        return [analytics.daily_series.__wrapped__(state['cube'], col)
+                for col in ('silence (in hours)', 'voice (in hours)', 'noise (in hours)',
+                            'conversation_duration_in_hours', 'CALLS_duration_in_minutes')]
+
+    def participants():
+        state['participants'] = build_participant_table(state['df'])
+
+    def correlations():
+        state['correlations'] = CorrelationEngine(state['df'])
+        state['correlations'].correlate()
+
+    def exercise_trend():
+        analytics.overall_mean.__wrapped__(state['cube'], 'walking (in hours)')
+        analytics.daily_means_long.__wrapped__(state['cube'], ('walking (in hours)', 'running (in hours)'))
+
+    return [
+        ('data_descriptor.load_cold', cold_load),
+        ('data_descriptor.load_warm', lambda: load_dataframe(path=path)),
+        ('data_descriptor.table_page', table_page),
+        ('data_descriptor.csv', csv_export),
+        ('behavior_patterns.daily_cube', daily_cube),
+        ('behavior_patterns.series', behavior_patterns),
+        ('exercise.trend', exercise_trend),
+        ('self_reports.panas', lambda: analytics.weekday_profile.__wrapped__(state['df'], tuple(analytics.PANAS_COLUMNS))),
+        ('self_reports.participants', participants),
+        ('self_reports.big_five', lambda: analytics.trait_scores_long.__wrapped__(state['participants'])),
+        ('correlations.build', correlations),
+        ('correlations.spearman_lagged', lambda: state['correlations'].correlate('spearman', lag=1)),
+    ]
+
+
+def measure(step, repeat=3):
+    """Return the best wall time of `repeat` runs of `step`, its peak memory and the memory it retains.
+
+    Memory is traced in one extra run, so tracemalloc overhead does not skew the
+    times. retained_blocks/retained_bytes are the blocks allocated by the step
+    that are still alive after it (e.g. cached results), not every allocation.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        # only blocks allocated since start() are traced
+        retained = tracemalloc.take_snapshot().statistics('filename')
+    finally:
+        tracemalloc.stop()
+    return {'seconds': round(min(times), 6), 'peak_bytes': peak,
+            'retained_blocks': sum(stat.count for stat in retained),
+            'retained_bytes': sum(stat.size for stat in retained)}
+
+
+def run(scales, repeat=3, source=DATA_PATH):
+    base = pd.read_pickle(source)
+    base['date'] = pd.to_datetime(base['date'].astype("str"), format='%Y-%m-%d')
+    results = []
+    try:
+        for factor in scales:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'dataframe')
+                frame = scale_frame(base, factor)
+                frame.to_pickle(path)
+                rows = len(frame)
+                del frame
+                for name, step in page_steps(path):
+                    best = measure(step, repeat)
+                    results.append({'step': name, 'scale': factor, 'rows': rows, **best})
+                    print(f"{name:32s} x{factor:<5d} {best['seconds'] * 1000:10.1f} ms "
+                          f"{best['peak_bytes'] / 2 ** 20:9.1f} MiB peak {best['retained_blocks']:10d} blocks retained")
+    finally:
+        data_store.clear_cache()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_path=HISTORY_PATH):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def regressions(history, results, repeat, ratio=REGRESSION_RATIO, window=HISTORY_WINDOW,
+                floor=MIN_REGRESSION_SECONDS):
+    """Return the steps of `results` that got slower than `ratio` times their median time in `history`.
+
+    Each step is compared with its last `window` runs at the same scale and
+    `repeat` count; steps less than `floor` seconds slower are never reported,
+    so the jitter of millisecond steps does not fail the run.
+    """
+    before = {}
+    for record in history:
+        if record.get('repeat') != repeat:
+            continue
+        for r in record['results']:
+            before.setdefault((r['step'], r['scale']), []).append(r['seconds'])
+    slower = []
+    for r in results:
+        times = before.get((r['step'], r['scale']), [])[-window:]
+        if not times:
+            continue
+        median = float(np.median(times))
+        if r['seconds'] > ratio * median and r['seconds'] - median >= floor:
+            slower.append((r['step'], r['scale'], median, r['seconds']))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data preparation of every dashboard page.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help="synthetic size factors of data/dataframe to run (default: %(default)s, 1000 is slow)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per step, the fastest is kept")
+    parser.add_argument('--history', default=HISTORY_PATH, help="JSON lines file the run is appended to")
+    parser.add_argument('--data', default=DATA_PATH)
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    results = run(args.scales, args.repeat, args.data)
+    record = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+              'python': platform.python_version(), 'pandas': pd.__version__, 'repeat': args.repeat,
+              'results': results}
+    os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+    with open(args.history, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    slower = regressions(history, results, args.repeat)
+    for step, factor, was, now in slower:
+        print(f"REGRESSION {step} x{factor}: median {was * 1000:.1f} ms -> {now * 1000:.1f} ms")
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from aggregates import build_daily_cube, cube_path, is_cube_current, is_participant_table_current, \
+    load_daily_cube, load_participant_table, read_daily_cube
+from data_store import DATA_PATH, clear_cache, load_dataframe, load_source_frame
+from export import FORMATS, write_export
+from ingest import append_batch
+from schema import SENSOR_COLUMNS
+
+NEW_ID = 999
+
+
+def make_batch(source, day, rows=3, new_id=None):
+    """Return `rows` rows of the pickle at `source` moved to `day` (and to participant `new_id`)."""
+    frame = pd.read_pickle(source)
+    # one participant's rows, so the per-participant scores of a new id agree
+    batch = frame[frame['id'] == frame['id'].iloc[0]].head(rows).copy()
+    batch['date'] = pd.Timestamp(day)
+    if new_id is not None:
+        batch['id'] = new_id
+    return batch
+
+
+def check_rows(path, base_rows, batch):
+    frame = load_dataframe(path=path)
+    assert len(frame) == len(base_rows) + len(batch), "appended rows are missing"
+    # appended rows are labelled after the base rows, in append order
+    first = int(base_rows.index.max()) + 1
+    assert list(frame.index[len(base_rows):]) == list(range(first, first + len(batch))), "appended rows mislabelled"
+    assert NEW_ID in frame['id'].cat.categories, "new participant id missing from the id categories"
+    appended = frame.iloc[len(base_rows):]
+    assert (appended['date'].to_numpy() == batch['date'].to_numpy()).all()
+    np.testing.assert_allclose(appended[SENSOR_COLUMNS].to_numpy('float64'),
+                               batch[SENSOR_COLUMNS].apply(pd.to_numeric, errors='coerce').astype('float32')
+                               .to_numpy('float64'))
+
+
+def check_cubes(path):
+    # ingest merges the cubes that were current instead of rebuilding them
+    frame = load_dataframe(['date', 'id'] + SENSOR_COLUMNS, path=path)
+    for by_id in (False, True):
+        assert is_cube_current(by_id, path), "cube was not merged"
+        merged = read_daily_cube(cube_path(by_id, path))
+        built = build_daily_cube(frame, by_id)
+        if by_id:
+            merged.index = merged.index.set_levels(merged.index.levels[1].astype('int64'), level=1)
+            built.index = built.index.set_levels(built.index.levels[1].astype('int64'), level=1)
+        built = built.reindex(merged.index)
+        assert merged.shape == built.shape, "merged cube has other rows than a rebuilt one"
+        np.testing.assert_allclose(merged.to_numpy('float64'), built.to_numpy('float64'), rtol=1e-5, atol=1e-5)
+    assert is_participant_table_current(path), "participant table was not merged"
+    assert NEW_ID in load_participant_table(path).index, "new participant missing from the participant table"
+
+
+def check_exports(path):
+    # every download format of the appended data, as the app and precompute.py write them
+    source = load_source_frame(path)
+    for fmt in FORMATS:
+        buffer = io.BytesIO()
+        write_export(source, fmt, buffer)
+        assert buffer.tell(), f"empty {fmt} export"
+
+
+def run(source=DATA_PATH):
+    """Append a csv batch to a scratch copy of `source` and check what the app reads back."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dataframe')
+        shutil.copy(source, path)
+        base_rows = load_dataframe(path=path)
+        for by_id in (False, True):
+            load_daily_cube(by_id, path)
+        load_participant_table(path)
+        # a new day, then a known day with a new participant
+        batch = pd.concat([make_batch(path, '2013-07-01'), make_batch(path, '2013-04-01', new_id=NEW_ID)],
+                          ignore_index=True)
+        for i, rows in enumerate((batch.iloc[:3], batch.iloc[3:])):
+            batch_path = os.path.join(tmp, f'batch{i}.csv')
+            rows.to_csv(batch_path, index=False)
+            append_batch(batch_path, path)
+        check_rows(path, base_rows, batch)
+        check_cubes(path)
+        check_exports(path)
+    clear_cache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check appending a batch to a scratch copy of the data.")
+    parser.add_argument('--data', default=DATA_PATH, help="data file to copy (default: %(default)s)")
+    args = parser.parse_args()
+    run(args.data)
+    print("ok")
@@ -0,0 +1,169 @@
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMA, SCHEMA_VERSION
+
+META_NAME = 'meta.json'
+# names the version directory readers open, replaced atomically when a new version is written
+CURRENT_NAME = 'CURRENT'
+# versions older than the current one that are kept for processes that resolved the pointer just before
+KEEP_OLD_VERSIONS = 1
+EPOCH = np.datetime64('1970-01-01', 'D')
+# missing dates and times
+MISSING = -1 << 31
+
+
+def _encode(values):
+    """Return (kind, array, extra metadata) of one column of a normalized frame."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # codes in the integer type pandas picks for this many categories, so they load without a copy
+        return 'category', values.cat.codes.to_numpy(), {
+            'categories': values.cat.categories.tolist(), 'ordered': bool(values.cat.ordered)}
+    if np.issubdtype(values.dtype, np.datetime64):
+        days = values.to_numpy().astype('datetime64[D]')
+        ordinals = (days - EPOCH).astype('int64')
+        ordinals[np.isnat(days)] = MISSING
+        return 'days', ordinals.astype('int32'), {}
+    if values.dtype == object:
+        # dinning_time holds datetime.time values (or missing ones)
+        seconds = [MISSING if not isinstance(t, datetime.time) else t.hour * 3600 + t.minute * 60 + t.second
+                   for t in values]
+        return 'time', np.array(seconds, dtype='int32'), {}
+    return 'numeric', values.to_numpy(dtype=SCHEMA.get(values.name, values.dtype)), {}
+
+
+def current_version(dst):
+    """Return the version directory of the store `dst` that readers should open, or None."""
+    try:
+        with open(os.path.join(dst, CURRENT_NAME)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(dst, name) if name else None
+
+
+def _versions(dst):
+    # version directory names sort in the order they were written
+    return sorted(name for name in os.listdir(dst)
+                  if not name.startswith('.') and os.path.exists(os.path.join(dst, name, META_NAME)))
+
+
+def write_compact(frame, dst, source=None):
+    """Write the normalized `frame` as a new version of the store `dst`, one .npy file per column.
+
+    Categories are stored as codes, dates as int32 days since 1970-01-01 and
+    times of day as int32 seconds; numeric columns keep their (float32) dtype.
+    Every version is written to its own directory and the CURRENT pointer is
+    switched to it atomically, so processes mapping an older version keep a
+    complete one. `source` (e.g. the size, mtime and hash of the file the frame
+    was read from) is stored as is in meta.json. Returns the new version directory.
+    """
+    os.makedirs(dst, exist_ok=True)
+    version = f"{time.time_ns()}-{os.getpid()}"
+    tmp = os.path.join(dst, f".tmp-{version}")
+    os.makedirs(tmp)
+    try:
+        columns = []
+        for i, (name, values) in enumerate(frame.items()):
+            kind, array, extra = _encode(values)
+            np.save(os.path.join(tmp, f'{i}.npy'), array, allow_pickle=False)
+            columns.append({'name': name, 'file': f'{i}.npy', 'kind': kind, **extra})
+        if isinstance(frame.index, pd.RangeIndex):
+            index = {'start': frame.index.start, 'stop': frame.index.stop}
+        else:
+            np.save(os.path.join(tmp, 'index.npy'), frame.index.to_numpy(dtype='int64'), allow_pickle=False)
+            index = {'file': 'index.npy'}
+        with open(os.path.join(tmp, META_NAME), 'w') as f:
+            json.dump({'schema_version': SCHEMA_VERSION, 'source': source, 'rows': len(frame),
+                       'index': index, 'columns': columns}, f)
+        os.replace(tmp, os.path.join(dst, version))
+        pointer = os.path.join(dst, f".{CURRENT_NAME}-{version}")
+        with open(pointer, 'w') as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(dst, CURRENT_NAME))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    prune(dst)
+    return os.path.join(dst, version)
+
+
+def prune(dst, keep=KEEP_OLD_VERSIONS):
+    """Delete the versions of the store `dst` older than the current one, but the `keep` latest of them.
+
+    Processes that already opened a deleted version keep reading it: its files
+    stay mapped until they close them.
+    """
+    current = current_version(dst)
+    versions = _versions(dst)
+    if current is None or os.path.basename(current) not in versions:
+        return []
+    older = versions[:versions.index(os.path.basename(current))]
+    removed = older[:max(0, len(older) - keep)]
+    for name in removed:
+        shutil.rmtree(os.path.join(dst, name), ignore_errors=True)
+    return removed
+
+
+class CompactStore:
+    """Read-only, memory-mapped view of a version directory written by write_compact.
+
+    Arrays are mapped from the files rather than read, so every process
+    (Streamlit worker) serving the same data shares their pages through the OS
+    page cache. All files are mapped when the store is opened (pages are still
+    only read on access), so a version deleted afterwards stays readable.
+    array() and codes-level accessors are zero-copy; column() returns pandas
+    objects over the mapped arrays wherever the dtype allows.
+    """
+
+    def __init__(self, src):
+        self.src = src
+        with open(os.path.join(src, META_NAME)) as f:
+            self.meta = json.load(f)
+        self.specs = {spec['name']: spec for spec in self.meta['columns']}
+        self._arrays = {name: np.load(os.path.join(src, spec['file']), mmap_mode='r')
+                        for name, spec in self.specs.items()}
+        index = self.meta['index']
+        self._index = np.load(os.path.join(src, index['file']), mmap_mode='r') if 'file' in index else None
+
+    @property
+    def columns(self):
+        return list(self.specs)
+
+    def array(self, name):
+        """Return the stored array of column `name` (codes, day ordinals, seconds or values), memory-mapped."""
+        return self._arrays[name]
+
+    def index(self):
+        if self._index is not None:
+            return pd.Index(self._index, copy=False)
+        return pd.RangeIndex(self.meta['index']['start'], self.meta['index']['stop'])
+
+    def column(self, name, index=None):
+        """Return column `name` as a Series; numeric and categorical columns share the mapped memory."""
+        spec, values = self.specs[name], self.array(name)
+        if spec['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(spec['categories'],
+                                                                                 spec['ordered']))
+        elif spec['kind'] == 'days':
+            # pandas needs datetime64[ns], materialized once per process (8 bytes a row)
+            dates = (EPOCH + values.astype('timedelta64[D]')).astype('datetime64[ns]')
+            dates[values == MISSING] = np.datetime64('NaT')
+            values = dates
+        elif spec['kind'] == 'time':
+            # one datetime.time object per distinct time, shared by the rows holding it
+            seconds, inverse = np.unique(values, return_inverse=True)
+            times = np.array([None if s == MISSING else datetime.time(s // 3600, s // 60 % 60, s % 60)
+                              for s in seconds.tolist()], dtype=object)
+            values = times[inverse.reshape(-1)]
+        return pd.Series(values, index=self.index() if index is None else index, name=name, copy=False)
+
+    def to_frame(self, columns=None):
+        index = self.index()
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self.column(name, index) for name in columns}, index=index, copy=False)
@@ -0,0 +1,217 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_store import DATA_PATH, data_version, load_dataframe
+from schema import NUMERIC_COLUMNS
+
+METHODS = ('pearson', 'spearman')
+# 'daily': one observation per participant-day, 'participant': one per participant (means over the days)
+LEVELS = ('daily', 'participant')
+MAX_LAG = 7
+# pairs with fewer common observations than this get no correlation
+MIN_PERIODS = 3
+
+# path -> (data version, CorrelationEngine)
+_engines = {}
+_lock = threading.Lock()
+
+DAY = pd.Timedelta(days=1)
+
+
+def _fingerprints(frame):
+    # date -> (number of rows, sum of their row hashes), changes when any row of the date changes
+    hashes = pd.Series(pd.util.hash_pandas_object(frame, index=False).to_numpy(), index=frame['date'].to_numpy())
+    grouped = hashes.groupby(level=0)
+    return dict(zip(grouped.size().index, zip(grouped.size().tolist(), grouped.sum().tolist())))
+
+
+def _pair_sums(x, y):
+    """Return the sums needed for pairwise-complete correlations of the columns of `x` with those of `y`.
+
+    `x` and `y` are (batch, observations, columns) arrays with NaN for missing
+    values; the result is (batch, 6, columns, columns): the number of complete
+    pairs and the sums of x, y, x², y² and xy over them.
+    """
+    valid_x, valid_y = ~np.isnan(x), ~np.isnan(y)
+    x0 = np.where(valid_x, x, 0).astype('float64')
+    y0 = np.where(valid_y, y, 0).astype('float64')
+    valid_x, valid_y = valid_x.astype('float64'), valid_y.astype('float64')
+    x0t, valid_xt = x0.transpose(0, 2, 1), valid_x.transpose(0, 2, 1)
+    return np.stack([valid_xt @ valid_y, x0t @ valid_y, valid_xt @ y0,
+                     (x0 * x0).transpose(0, 2, 1) @ valid_y, valid_xt @ (y0 * y0), x0t @ y0], axis=1)
+
+
+def _pearson(sums):
+    """Return the correlations and pair counts of the (6, columns, columns) sums of _pair_sums."""
+    n, sx, sy, sxx, syy, sxy = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / n
+        r = cov / np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n))
+    r[n < MIN_PERIODS] = np.nan
+    return np.clip(r, -1, 1), n.astype('int64')
+
+
+def _spearman(x, y):
+    """Return the Spearman correlations and pair counts of the columns of `x` with those of `y`.
+
+    Every pair is ranked over the observations where both of its values are
+    present (ties averaged), like pandas' DataFrame.corr. Columns with the same
+    missing values share their ranks, so ranking is done once per pair of
+    missing-value patterns rather than once per pair of columns.
+    """
+    r = np.full((x.shape[1], y.shape[1]), np.nan)
+    n = np.zeros((x.shape[1], y.shape[1]), dtype='int64')
+    # observations without a value in x or in y take part in no pair
+    present = ~np.isnan(x).all(axis=1) & ~np.isnan(y).all(axis=1)
+    x, y = x[present], y[present]
+    x_masks, x_groups = np.unique(~np.isnan(x).T, axis=0, return_inverse=True)
+    y_masks, y_groups = np.unique(~np.isnan(y).T, axis=0, return_inverse=True)
+    for i, x_mask in enumerate(x_masks):
+        x_cols = np.flatnonzero(x_groups.reshape(-1) == i)
+        for j, y_mask in enumerate(y_masks):
+            y_cols = np.flatnonzero(y_groups.reshape(-1) == j)
+            rows = x_mask & y_mask
+            x_ranks = pd.DataFrame(x[rows][:, x_cols]).rank().to_numpy(dtype='float64')
+            y_ranks = pd.DataFrame(y[rows][:, y_cols]).rank().to_numpy(dtype='float64')
+            r[np.ix_(x_cols, y_cols)], n[np.ix_(x_cols, y_cols)] = _pearson(
+                _pair_sums(x_ranks[None], y_ranks[None])[0])
+    return r, n
+
+
+class CorrelationEngine:
+    """Pearson and Spearman correlations of the numeric StudentLife columns.
+
+    Participant-days (duplicated rows of a day averaged) are kept as a float32
+    (dates, ids, columns) block over the full calendar range. For Pearson the
+    pairwise-complete sums of every date and lag are cached, so a date range is
+    answered by adding them up; Spearman ranks the selected days of the block,
+    every pair of columns over the observations both of them have.
+    update() recomputes only the dates whose rows changed.
+    """
+
+    def __init__(self, frame, columns=NUMERIC_COLUMNS):
+        self.columns = [col for col in columns if col in frame.columns]
+        self.ids = []
+        self.dates = pd.DatetimeIndex([])
+        self.block = np.empty((0, 0, len(self.columns)), dtype='float32')
+        self._fingerprints = {}
+        # lag -> (dates - lag, 6, columns, columns) sums, the first axis being the date of the leading variable
+        self._sums = {}
+        self._lock = threading.RLock()
+        self.update(frame)
+
+    def update(self, frame):
+        """Bring the engine up to date with `frame`, recomputing only the dates whose rows changed."""
+        fingerprints = _fingerprints(frame[['id', 'date'] + self.columns])
+        changed = pd.DatetimeIndex(sorted(date for date in fingerprints.keys() | self._fingerprints.keys()
+                                          if fingerprints.get(date) != self._fingerprints.get(date)))
+        if not len(changed):
+            return
+        with self._lock:
+            known_ids = set(self.ids)
+            ids = self.ids + [i for i in frame['id'].unique().tolist() if i not in known_ids]
+            known = self.dates.union(changed)
+            dates = pd.date_range(known.min(), known.max(), freq='D')
+            offset = int((self.dates[0] - dates[0]) / DAY) if len(self.dates) else 0
+
+            block = np.full((len(dates), len(ids), len(self.columns)), np.nan, dtype='float32')
+            block[offset:offset + len(self.dates), :len(self.ids)] = self.block
+            dirty = ((changed - dates[0]) / DAY).astype('int64').to_numpy()
+            block[dirty] = np.nan
+            rows = frame[frame['date'].isin(changed)]
+            means = rows.groupby(['id', 'date'], observed=True)[self.columns].mean()
+            id_pos = pd.Index(ids).get_indexer(means.index.get_level_values('id'))
+            date_pos = ((means.index.get_level_values('date') - dates[0]) / DAY).astype('int64')
+            block[date_pos, id_pos] = means.to_numpy(dtype='float32')
+
+            stale = np.ones(len(dates), dtype=bool)
+            stale[offset:offset + len(self.dates)] = False
+            stale[dirty] = True
+            sums = {lag: self._update_sums(old_sums, block, stale, offset, lag)
+                    for lag, old_sums in self._sums.items()}
+            self.ids, self.dates, self.block, self._sums = ids, dates, block, sums
+            self._fingerprints = fingerprints
+
+    @staticmethod
+    def _update_sums(old_sums, block, stale, offset, lag):
+        count = max(len(block) - lag, 0)
+        sums = np.empty((count,) + old_sums.shape[1:])
+        kept = max(0, min(len(old_sums), count - offset))
+        sums[offset:offset + kept] = old_sums[:kept]
+        # a leading date is recomputed when it or its lagged date changed or is new
+        redo = np.flatnonzero(stale[:count] | stale[lag:lag + count])
+        if len(redo):
+            sums[redo] = _pair_sums(block[redo], block[redo + lag])
+        return sums
+
+    def _lag_sums(self, lag):
+        if lag not in self._sums:
+            count = max(len(self.block) - lag, 0)
+            self._sums[lag] = _pair_sums(self.block[:count], self.block[lag:lag + count])
+        return self._sums[lag]
+
+    def _positions(self, date_range):
+        if date_range is None or not len(self.dates):
+            return 0, len(self.dates)
+        start = max(0, int((pd.Timestamp(date_range[0]) - self.dates[0]) / DAY))
+        stop = min(len(self.dates), int((pd.Timestamp(date_range[1]) - self.dates[0]) / DAY) + 1)
+        return start, max(start, stop)
+
+    def correlate(self, method='pearson', level='daily', lag=0, date_range=None, columns=None):
+        """Return the correlations of `columns` (all by default) as a long (x, y, r, n) frame.
+
+        At the 'daily' level x is taken `lag` days before y, within the same
+        participant, and both days must fall in `date_range` (first, last day).
+        At the 'participant' level every participant contributes the means of
+        its days in the range and `lag` must be 0.
+        """
+        if method not in METHODS:
+            raise ValueError(f"unknown correlation method {method!r}, expected one of {METHODS}")
+        if level not in LEVELS:
+            raise ValueError(f"unknown correlation level {level!r}, expected one of {LEVELS}")
+        if level == 'participant' and lag:
+            raise ValueError("lagged correlations need the 'daily' level")
+        if not 0 <= lag <= MAX_LAG:
+            raise ValueError(f"lag must be between 0 and {MAX_LAG} days")
+        columns = self.columns if columns is None else list(columns)
+        picked = [self.columns.index(col) for col in columns]
+        with self._lock:
+            start, stop = self._positions(date_range)
+            if level == 'daily' and method == 'pearson':
+                r, n = _pearson(self._lag_sums(lag)[start:max(start, stop - lag)].sum(axis=0))
+            else:
+                block = self.block[start:stop][:, :, picked]
+                if level == 'daily':
+                    lead = max(0, len(block) - lag)
+                    x, y = block[:lead].reshape(-1, len(picked)), block[lag:lag + lead].reshape(-1, len(picked))
+                else:
+                    counts = (~np.isnan(block)).sum(axis=0)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        x = y = np.nansum(block, axis=0, dtype='float64') / counts
+                if method == 'spearman':
+                    r, n = _spearman(x, y)
+                else:
+                    r, n = _pearson(_pair_sums(x[None], y[None])[0])
+                picked = list(range(len(picked)))
+        r, n = r[np.ix_(picked, picked)], n[np.ix_(picked, picked)]
+        index = pd.MultiIndex.from_product([columns, columns], names=['x', 'y'])
+        return pd.DataFrame({'r': r.ravel(), 'n': n.ravel()}, index=index).reset_index()
+
+
+def load_correlations(path=DATA_PATH):
+    """Return the CorrelationEngine of the frame at `path`, updated when the data changes."""
+    version = data_version(path)
+    with _lock:
+        cached = _engines.get(path)
+        if cached is None or cached[0] != version:
+            frame = load_dataframe(['id', 'date'] + NUMERIC_COLUMNS, path=path)
+            if cached is None:
+                engine = CorrelationEngine(frame)
+            else:
+                engine = cached[1]
+                engine.update(frame)
+            cached = (version, engine)
+            _engines[path] = cached
+        return cached[1]
@@ -0,0 +1,348 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas.api.types import is_integer_dtype, union_categoricals
+
+from compact_store import META_NAME, CompactStore, current_version, write_compact
+from instrument import stage
+from schema import DERIVED_COLUMNS, SCHEMA, SCHEMA_VERSION, normalize
+
+DATA_PATH = 'data/dataframe'
+COMPACT_PATH = DATA_PATH + '.compact'
+MANIFEST_NAME = '_manifest.json'
+
+logger = logging.getLogger(__name__)
+
+# one entry per data file, shared by every session of this streamlit process
+_cache = {}
+_stats = {'hits': 0, 'misses': 0}
+# manifest path -> ((mtime, size), partition files)
+_manifests = {}
+# source path -> ((mtime, size), content hash), so a touched pickle is only hashed once
+_digests = {}
+_lock = threading.Lock()
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(frame):
+    """Return a hash of the values, index, dtypes and column names of a frame (or series)."""
+    digest = hashlib.sha256()
+    labels = (list(frame.columns), list(frame.dtypes)) if isinstance(frame, pd.DataFrame) else (frame.name, frame.dtype)
+    digest.update(repr(labels).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def _frozen_column(column):
+    if not isinstance(column.dtype, np.dtype):
+        return column
+    values = column.to_numpy()
+    # read-only arrays (memory-mapped or Arrow buffers) are shared as is
+    if values.flags.writeable:
+        values = values.copy()
+        values.flags.writeable = False
+    return pd.Series(values, index=column.index, name=column.name, copy=False)
+
+
+def freeze(frame):
+    """Return `frame` (or a series) rebuilt from read-only column arrays.
+
+    In-place writes through any view of a shared (cached) object then raise
+    instead of silently changing it for every other caller.
+    """
+    if isinstance(frame, pd.Series):
+        return _frozen_column(frame)
+    return pd.DataFrame({name: _frozen_column(column) for name, column in frame.items()},
+                        index=frame.index, copy=False)
+
+
+def _normalize(frame, source):
+    # typed once at ingest, so pages never coerce columns again
+    with stage('coerce_dtypes'):
+        frame, report = normalize(frame)
+    for col, count in report['failures'].items():
+        logger.warning("%s: %d value(s) of %r could not be coerced to %s", source, count, col, SCHEMA[col])
+    if report['missing']:
+        logger.warning("%s: missing columns %s", source, report['missing'])
+    return frame
+
+
+def convert_to_compact(src=DATA_PATH, dst=COMPACT_PATH):
+    """Write the pickled frame at `src` as a new version of the memory-mappable compact store (see compact_store) `dst`."""
+    stat = os.stat(src)
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': _source_digest(src, stat)}
+    frame = _normalize(pd.read_pickle(src), src)
+    return os.path.join(write_compact(frame, dst, source=source), META_NAME)
+
+
+def _source_digest(src, stat):
+    cached = _digests.get(src)
+    if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+        cached = ((stat.st_mtime_ns, stat.st_size), _file_digest(src))
+        _digests[src] = cached
+    return cached[1]
+
+
+def _is_current(src, dst):
+    # the copy is current while the pickle has the size and mtime it was converted from, or else the same
+    # content: a pickle replaced by one with an older mtime is a change too
+    if dst is None or not os.path.exists(dst):
+        return False
+    with open(dst) as f:
+        meta = json.load(f)
+    source = meta.get('source')
+    if meta.get('schema_version') != SCHEMA_VERSION or not source:
+        return False
+    stat = os.stat(src)
+    if stat.st_size != source['size']:
+        return False
+    return stat.st_mtime_ns == source['mtime_ns'] or _source_digest(src, stat) == source['digest']
+
+
+def _columnar_source(src):
+    # prefer an up to date compact copy of the pickle, creating it on first use
+    version = current_version(src + '.compact')
+    dst = None if version is None else os.path.join(version, META_NAME)
+    try:
+        if not _is_current(src, dst):
+            dst = convert_to_compact(src, src + '.compact')
+    except OSError:
+        # read-only data directory: keep serving the pickle
+        return None
+    # cache entries of older versions would keep their files mapped
+    for old in [key for key in _cache if key != dst and key.startswith(src + '.compact' + os.sep)]:
+        del _cache[old]
+    return dst
+
+
+def partitions_dir(path=DATA_PATH):
+    return path + '.partitions'
+
+
+def _partition_files(path):
+    # appended partitions are listed, in append order, by the manifest ingest.py rewrites
+    manifest = os.path.join(partitions_dir(path), MANIFEST_NAME)
+    try:
+        stat = os.stat(manifest)
+    except FileNotFoundError:
+        return ()
+    cached = _manifests.get(manifest)
+    if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+        with open(manifest) as f:
+            files = tuple(os.path.join(partitions_dir(path), name) for name in json.load(f)['files'])
+        cached = ((stat.st_mtime_ns, stat.st_size), files)
+        _manifests[manifest] = cached
+    return cached[1]
+
+
+def _entry_for(path):
+    # (re)validate the cache entry of `path` against its mtime/size and content hash
+    stat = os.stat(path)
+    entry = _cache.get(path)
+    if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+        return entry
+    digest = _file_digest(path)
+    if entry is not None and entry['digest'] == digest:
+        # file was touched but its content did not change
+        entry['mtime'], entry['size'] = stat.st_mtime_ns, stat.st_size
+        return entry
+    entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'digest': digest,
+             'columns': {}, 'order': None, 'next_label': None, 'parts': (), 'store': None}
+    _cache[path] = entry
+    return entry
+
+
+def _restore_categories(frame):
+    # Parquet only round-trips string categoricals, restore the numeric ones (`id`)
+    return frame.astype({col: 'category' for col in frame.columns
+                         if SCHEMA.get(col) == 'category' and not isinstance(frame[col].dtype, pd.CategoricalDtype)})
+
+
+def _read_base(entry, path, columns):
+    if path.endswith(META_NAME):
+        if entry['store'] is None:
+            entry['store'] = CompactStore(os.path.dirname(path))
+            entry['order'] = entry['store'].columns
+        # numeric and categorical columns are views of the memory-mapped files
+        with stage('map_compact'):
+            frame = entry['store'].to_frame(entry['order'] if columns is None else columns)
+    elif path.endswith('.parquet'):
+        if entry['order'] is None:
+            schema = pq.read_schema(path)
+            index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+            entry['order'] = [name for name in schema.names if name not in index_columns]
+            if columns is None:
+                columns = entry['order']
+        # only the requested columns are read from disk
+        with stage('read_parquet'):
+            frame = _restore_categories(pd.read_parquet(path, columns=columns, engine='pyarrow', memory_map=True))
+    else:
+        with stage('read_pickle'):
+            frame = pd.read_pickle(path)
+        frame = _normalize(frame, path)
+        entry['order'] = list(frame.columns)
+        frame = frame[entry['order'] if columns is None else columns]
+    if entry['next_label'] is None and len(frame.index) and is_integer_dtype(frame.index.dtype):
+        entry['next_label'] = int(frame.index.max()) + 1
+    return frame
+
+
+def _read_partitions(files, columns, first_label):
+    with stage('read_partitions'):
+        frame = pd.concat([_restore_categories(pd.read_parquet(f, columns=columns, engine='pyarrow'))
+                           for f in files], ignore_index=True)
+    # appended rows are labelled after the rows of the base file, in append order
+    frame.index = pd.RangeIndex(first_label, first_label + len(frame))
+    return frame
+
+
+def _concat_columns(first, second):
+    out = {}
+    for col in first.columns:
+        a, b = first[col], second[col]
+        if a.dtype != b.dtype and isinstance(a.dtype, pd.CategoricalDtype):
+            # new categories (e.g. new participant ids) arrived with the appended rows
+            values = union_categoricals([a.array, pd.Categorical(b)], sort_categories=True)
+            out[col] = pd.Series(values, index=a.index.append(b.index), name=col)
+        else:
+            out[col] = pd.concat([a, b])
+    return pd.DataFrame(out, copy=False)
+
+
+def _load_columns(entry, source, path, columns):
+    parts = _partition_files(path)
+    hit = True
+    if entry['parts'] != parts:
+        new_parts = parts[len(entry['parts']):]
+        if entry['parts'] == parts[:len(entry['parts'])] and entry['columns']:
+            # extend the cached columns with the newly appended partitions only
+            cached = list(entry['columns'])
+            first_label = entry['next_label'] + sum(pq.read_metadata(f).num_rows for f in entry['parts'])
+            combined = _concat_columns(pd.DataFrame(entry['columns'], copy=False),
+                                       _read_partitions(new_parts, cached, first_label))
+            entry['columns'] = dict(freeze(combined).items())
+        else:
+            entry['columns'] = {}
+        entry['parts'] = parts
+        hit = False
+
+    wanted = entry['order'] if columns is None and entry['order'] is not None else columns
+    missing = None if wanted is None else [c for c in wanted if c not in entry['columns']]
+    if missing is None or missing:
+        frame = _read_base(entry, source, missing)
+        if parts:
+            frame = _concat_columns(frame, _read_partitions(parts, list(frame.columns), entry['next_label']))
+        entry['columns'].update(freeze(frame).items())
+        hit = False
+    return hit
+
+
+def load_dataframe(columns=None, path=DATA_PATH):
+    """Return a read-only view of the StudentLife frame stored at `path`.
+
+    Only `columns` (all of them by default) are read, from a memory-mapped compact
+    copy of the pickle when one can be kept next to it (shared by all processes
+    through the page cache), followed by the rows appended as partitions by
+    ingest.py. Loaded columns stay cached per process while the
+    file's mtime/size and content hash are unchanged; new partitions are read
+    once and appended to them. Callers get a new frame: adding or replacing
+    columns only affects their own view, writing into existing values raises.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        source = path if path.endswith('.parquet') else _columnar_source(path) or path
+        entry = _entry_for(source)
+        hit = _load_columns(entry, source, path, columns)
+        _stats['hits' if hit else 'misses'] += 1
+        wanted = entry['order'] if columns is None else list(columns)
+        if not wanted:
+            index = next(iter(entry['columns'].values())).index if entry['columns'] else None
+            return pd.DataFrame(index=index)
+        return pd.DataFrame({c: entry['columns'][c] for c in wanted}, copy=False)
+
+
+def load_source_frame(path=DATA_PATH):
+    """Return the StudentLife frame at `path` as it is stored, e.g. for downloads.
+
+    The pickle is read as is: no declared dtypes (its values keep their full
+    precision) and no derived DayName column. Rows appended by ingest.py
+    follow with the float32 values they were stored with, in the representation
+    of the pickle's columns (e.g. strings for the sensor hours). Rows carry the same
+    labels as in load_dataframe. Not cached, every call reads the files.
+    """
+    path = os.path.abspath(path)
+    with stage('read_pickle'):
+        frame = pd.read_pickle(path)
+    with _lock:
+        parts = _partition_files(path)
+    if not parts:
+        return frame
+    first_label = int(frame.index.max()) + 1 if len(frame.index) else 0
+    appended = _read_partitions(parts, None, first_label).drop(columns=DERIVED_COLUMNS, errors='ignore')
+    appended = pd.DataFrame({col: _as_stored(appended[col], frame[col]) for col in frame.columns
+                             if col in appended.columns}, index=appended.index)
+    return pd.concat([frame, appended])
+
+
+def _as_stored(values, stored):
+    # appended (normalized) values in the representation of the pickle's column, so every export
+    # format sees one type per column: e.g. the sensor hours are kept as strings in the pickle
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    if stored.dtype == object:
+        kinds = set(stored.dropna().map(type))
+        if kinds == {str}:
+            # str of the float32 scalar gives its shortest repr, e.g. '9.87'
+            return pd.Series([None if pd.isna(v) else str(v) for v in values.to_numpy()], index=values.index,
+                             dtype=object)
+        if kinds == {datetime.time}:
+            # dinning_time arrives as text from csv batches
+            return pd.Series([v if isinstance(v, datetime.time) or pd.isna(v) else datetime.time.fromisoformat(v)
+                              for v in values.to_numpy()], index=values.index, dtype=object)
+        return values.astype(object)
+    if is_integer_dtype(stored.dtype) and values.isna().any():
+        return values.astype('float64')
+    return values.astype(stored.dtype)
+
+
+def data_version(path=DATA_PATH):
+    """Return a hash of the data `load_dataframe(path=path)` currently reads."""
+    path = os.path.abspath(path)
+    with _lock:
+        source = path if path.endswith('.parquet') else _columnar_source(path) or path
+        digest = _entry_for(source)['digest']
+        parts = _partition_files(path)
+    if not parts:
+        return digest
+    return hashlib.sha256('\n'.join((digest,) + parts).encode('utf-8')).hexdigest()
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_cache))
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+        _manifests.clear()
+        _digests.clear()
+        _stats['hits'] = _stats['misses'] = 0
+
+
+if __name__ == '__main__':
+    print(convert_to_compact())
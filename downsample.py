@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# width in pixels the time-series charts are drawn at; one point per pixel is plenty
+CHART_WIDTH = 800
+
+
+def lttb_indices(x, y, n_out):
+    """Return the positions of the `n_out` points largest-triangle-three-buckets keeps of (x, y).
+
+    The first and last points are always kept; every bucket in between contributes
+    the point forming the largest triangle with the previously kept point and the
+    mean of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    kept = np.empty(n_out, dtype='int64')
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        mean_x, mean_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+
+def minmax_indices(y, n_buckets):
+    """Return the positions of the minimum and maximum of each of `n_buckets` equal buckets of `y`."""
+    n = len(y)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype='float64')
+    kept = []
+    for bucket in np.array_split(np.arange(n), n_buckets):
+        values = y[bucket]
+        kept.extend({bucket[np.argmin(values)], bucket[np.argmax(values)]})
+    return np.sort(np.array(kept))
+
+
+def downsample_series(series, width=CHART_WIDTH, method='lttb'):
+    """Return at most about `width` points of `series` (indexed by date or number) for plotting.
+
+    Missing values are dropped first; `method` is 'lttb' or 'minmax'.
+    """
+    series = series.dropna()
+    if len(series) <= width:
+        return series
+    if method == 'lttb':
+        x = series.index.to_numpy()
+        if np.issubdtype(x.dtype, np.datetime64):
+            x = x.astype('datetime64[ns]').astype('int64')
+        return series.iloc[lttb_indices(x, series.to_numpy(), width)]
+    if method == 'minmax':
+        return series.iloc[minmax_indices(series.to_numpy(), width // 2)]
+    raise ValueError(f"unknown downsampling method {method!r}, expected 'lttb' or 'minmax'")
+
+
+def downsample_long(frame, x, y, by, width=CHART_WIDTH, method='lttb'):
+    """Downsample every `by` group of a long (x, by, y) frame to about `width` points.
+
+    `by` is a column or a list of columns, e.g. ['id', 'variable'] for one line per participant and variable.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    parts = []
+    for key, group in frame.groupby(keys, sort=False, observed=True):
+        key = key if isinstance(key, tuple) else (key,)
+        parts.append(downsample_series(group.set_index(x)[y], width, method).reset_index()
+                     .assign(**dict(zip(keys, key))))
+    if not parts:
+        return frame
+    return pd.concat(parts, ignore_index=True)[[col for col in frame.columns if col in [x, y] + keys]]
@@ -0,0 +1,85 @@
+import gzip
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from data_store import content_hash
+
+# format -> (file extension, mime type)
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/octet-stream'),
+}
+
+CHUNK_ROWS = 10000
+MAX_CACHED_EXPORTS = 8
+
+# (content hash, format) -> bytes, least recently used first
+_exports = OrderedDict()
+_lock = threading.Lock()
+
+
+def iter_csv_chunks(frame, chunksize=CHUNK_ROWS):
+    # encode the frame CHUNK_ROWS rows at a time instead of as one big string
+    for start in range(0, max(len(frame), 1), chunksize):
+        chunk = frame.iloc[start:start + chunksize]
+        yield chunk.to_csv(header=start == 0).encode('utf-8')
+
+
+def write_export(frame, fmt, fileobj, chunksize=CHUNK_ROWS):
+    """Stream `frame` in format `fmt` to the binary file object `fileobj`."""
+    if fmt == 'csv':
+        for chunk in iter_csv_chunks(frame, chunksize):
+            fileobj.write(chunk)
+    elif fmt == 'csv.gz':
+        with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz:
+            for chunk in iter_csv_chunks(frame, chunksize):
+                gz.write(chunk)
+    elif fmt == 'parquet':
+        frame.to_parquet(fileobj, engine='pyarrow')
+    else:
+        raise ValueError(f"unknown export format {fmt!r}, expected one of {list(FORMATS)}")
+
+
+def prepare_export(frame, fmt):
+    """Serialize `frame` as `fmt` unless an identical export is cached; return its key."""
+    key = (content_hash(frame), fmt)
+    with _lock:
+        if key in _exports:
+            _exports.move_to_end(key)
+            return key
+    buffer = io.BytesIO()
+    write_export(frame, fmt, buffer)
+    _store(key, buffer.getvalue())
+    return key
+
+
+def prepare_file_export(src, fmt):
+    """Cache the export file `src` already written in format `fmt` (e.g. by precompute.py); return its key."""
+    key = (os.path.abspath(src), fmt)
+    with _lock:
+        if key in _exports:
+            _exports.move_to_end(key)
+            return key
+    with open(src, 'rb') as f:
+        _store(key, f.read())
+    return key
+
+
+def _store(key, data):
+    with _lock:
+        _exports[key] = data
+        while len(_exports) > MAX_CACHED_EXPORTS:
+            _exports.popitem(last=False)
+
+
+def get_export(key):
+    """Return the bytes of a prepared export, or None once it was evicted."""
+    with _lock:
+        return _exports.get(key)
+
+
+def export_file_name(name, fmt):
+    return f"{name}.{FORMATS[fmt][0]}"
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import uuid
+
+import pandas as pd
+
+from aggregates import build_daily_cube, build_participant_table, cube_path, is_cube_current, \
+    is_participant_table_current, merge_daily_cubes, merge_participant_tables, participant_path, read_daily_cube, \
+    write_daily_cube, write_participant_table
+from data_store import DATA_PATH, MANIFEST_NAME, data_version, partitions_dir
+from schema import SCHEMA, normalize
+
+
+def read_batch(source):
+    """Read a batch of new rows from a .csv or .parquet file (or take a DataFrame as is)."""
+    if isinstance(source, pd.DataFrame):
+        return source
+    if source.endswith('.parquet'):
+        return pd.read_parquet(source, engine='pyarrow')
+    if source.endswith('.csv'):
+        return pd.read_csv(source)
+    raise ValueError(f"unsupported batch file {source!r}, expected .csv or .parquet")
+
+
+def validate_batch(batch):
+    """Check the columns of `batch` against SCHEMA and normalize it.
+
+    Unknown columns and rows without a valid id or date are rejected, declared
+    columns the batch lacks are filled with missing values. Returns the normalized
+    batch and the coercion report of schema.normalize.
+    """
+    batch = batch.drop(columns=['DayName'], errors='ignore')
+    unknown = [col for col in batch.columns if col not in SCHEMA]
+    if unknown:
+        raise ValueError(f"batch has columns that are not in the StudentLife schema: {unknown}")
+    for key in ('id', 'date'):
+        if key not in batch.columns:
+            raise ValueError(f"batch has no {key!r} column")
+    batch = batch.reindex(columns=list(SCHEMA))
+    batch, report = normalize(batch)
+    invalid = batch['id'].isna() | batch['date'].isna()
+    if invalid.any():
+        raise ValueError(f"{int(invalid.sum())} row(s) of the batch have no valid id or date")
+    return batch.reset_index(drop=True), report
+
+
+def _write_manifest(root, files):
+    tmp = os.path.join(root, MANIFEST_NAME + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'files': files}, f, indent=1)
+    os.replace(tmp, os.path.join(root, MANIFEST_NAME))
+
+
+def append_batch(source, path=DATA_PATH):
+    """Append the rows of `source` to the data at `path` as per-date Parquet partitions.
+
+    The partitions are listed in a manifest that data_store.load_dataframe checks
+    on every call, so running app sessions see the rows without a restart. Daily
+    cubes that were up to date are merged with the cube of the batch instead of
+    being rebuilt and new participants are added to the participant table.
+    Appends are expected to come from a single writer at a time.
+    Returns the coercion report of the batch.
+    """
+    batch, report = validate_batch(read_batch(source))
+    current_cubes = [by_id for by_id in (False, True) if is_cube_current(by_id, path)]
+    participants_current = is_participant_table_current(path)
+
+    root = partitions_dir(path)
+    manifest = os.path.join(root, MANIFEST_NAME)
+    files = []
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            files = json.load(f)['files']
+
+    for day, rows in batch.groupby(batch['date'].dt.strftime('%Y-%m-%d')):
+        name = f"date={day}/part-{uuid.uuid4().hex}.parquet"
+        os.makedirs(os.path.join(root, f"date={day}"), exist_ok=True)
+        tmp = os.path.join(root, name + '.tmp')
+        rows.to_parquet(tmp, engine='pyarrow', index=False)
+        os.replace(tmp, os.path.join(root, name))
+        files.append(name)
+    _write_manifest(root, files)
+
+    # the merged tables are stamped with the version that includes the new partitions
+    version = data_version(path)
+    for by_id in current_cubes:
+        dst = cube_path(by_id, path)
+        write_daily_cube(merge_daily_cubes(read_daily_cube(dst), build_daily_cube(batch, by_id)), dst, version)
+    if participants_current:
+        dst = participant_path(path)
+        write_participant_table(merge_participant_tables(pd.read_parquet(dst, engine='pyarrow'),
+                                                         build_participant_table(batch)), dst, version)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append new daily StudentLife rows to data/dataframe.")
+    parser.add_argument('batches', nargs='+', help=".csv or .parquet files with new rows")
+    parser.add_argument('--data', default=DATA_PATH, help="data file to append to (default: %(default)s)")
+    args = parser.parse_args()
+    for batch_path in args.batches:
+        batch_report = append_batch(batch_path, args.data)
+        print(f"{batch_path}: appended; coercion failures {batch_report['failures'] or 'none'}")
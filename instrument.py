@@ -0,0 +1,222 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+
+import pandas as pd
+import pyarrow as pa
+
+# set to 1 to time every rerun; off by default, stages then cost one attribute lookup
+ENV_VAR = 'STUDENTLIFE_PROFILE'
+LOG_ENV_VAR = 'STUDENTLIFE_PROFILE_LOG'
+LOG_PATH = 'logs/profile.jsonl'
+
+# one JSON record per rerun, appended to LOG_PATH unless handlers are configured elsewhere
+logger = logging.getLogger('studentlife.profile')
+
+# the run of the rerun executing on this thread, Streamlit runs each session's script in its own thread
+_local = threading.local()
+_setup_lock = threading.Lock()
+
+# runs recording right now on any thread (reruns and background jobs) and how many were ever started,
+# tracemalloc is process-wide so a stage overlapping another run is charged for its allocations too
+_active = weakref.WeakSet()
+_started = 0
+_runs_lock = threading.Lock()
+
+
+def _activity():
+    with _runs_lock:
+        return _started, len(_active)
+
+
+def enabled():
+    return os.environ.get(ENV_VAR, '') not in ('', '0')
+
+
+def _setup_log():
+    with _setup_lock:
+        if logger.handlers:
+            return
+        log_path = os.environ.get(LOG_ENV_VAR, LOG_PATH)
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+class Run:
+    """Stage timings, memory deltas and payload sizes recorded during one rerun.
+
+    Memory is traced process-wide: while other runs record at the same time
+    (concurrent sessions or background jobs) they reset each other's peaks and
+    a stage is charged for their allocations. Such stages are recorded with
+    `concurrent` set, their memory numbers only hold for a single active run.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.page = None
+        self.started = time.time()
+        self.records = []
+        self._stack = []
+        self._start = time.perf_counter()
+        self.seconds = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # nested stages are recorded under 'outer/inner'; the peak of an outer stage includes its inner ones
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        frame = {'name': '/'.join([f['name'] for f in self._stack] + [name]), 'peak': current}
+        self._stack.append(frame)
+        started, active = _activity()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            concurrent = active > 1 or _activity() != (started, 1)
+            self._stack.pop()
+            after, peak = tracemalloc.get_traced_memory()
+            peak = max(frame['peak'], peak)
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            self.records.append({'stage': frame['name'], 'seconds': round(seconds, 6),
+                                 'memory_delta_bytes': after - current, 'peak_bytes': peak - current,
+                                 'concurrent': concurrent, 'payload_bytes': None})
+
+    def payload(self, name, obj):
+        self.records.append({'stage': name, 'seconds': None, 'memory_delta_bytes': None, 'peak_bytes': None,
+                             'concurrent': None, 'payload_bytes': payload_bytes(obj)})
+
+    def attach(self, run):
+        """Add the records of `run` (e.g. of a background job's thread) under the current stage."""
+        prefix = self._stack[-1]['name'] + '/' if self._stack else ''
+        self.records.extend(dict(record, stage=prefix + record['stage']) for record in run.records)
+
+    def summary(self):
+        """Return the records as a frame, in the order the stages finished."""
+        return pd.DataFrame(self.records, columns=['stage', 'seconds', 'memory_delta_bytes', 'peak_bytes',
+                                                   'concurrent', 'payload_bytes'])
+
+
+def payload_bytes(obj):
+    """Return about how many bytes Streamlit sends to the browser for `obj`.
+
+    Frames and series are measured as the Arrow IPC stream they are sent as,
+    Altair charts as their Vega-Lite spec plus the Arrow stream of their data.
+    """
+    if isinstance(obj, pd.Series):
+        obj = obj.to_frame()
+    if isinstance(obj, pd.DataFrame):
+        table = pa.Table.from_pandas(obj)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().size
+    data = getattr(obj, 'data', None)
+    if isinstance(data, pd.DataFrame):
+        spec = obj.copy(deep=False)
+        spec.data = data.iloc[:0]
+        return len(spec.to_json().encode('utf-8')) + payload_bytes(data)
+    if hasattr(obj, 'to_json'):
+        return len(obj.to_json().encode('utf-8'))
+    return len(str(obj).encode('utf-8'))
+
+
+def start(session=None):
+    """Start recording the rerun on this thread and return its Run, or None when profiling is off."""
+    global _started
+    if not enabled():
+        _local.run = None
+        return None
+    _setup_log()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    run = Run(session)
+    with _runs_lock:
+        # a rerun interrupted before finish() left its run behind
+        if current() is not None:
+            _active.discard(current())
+        _active.add(run)
+        _started += 1
+    _local.run = run
+    return run
+
+
+def current():
+    return getattr(_local, 'run', None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the block as stage `name` of the current rerun; does nothing when profiling is off."""
+    run = current()
+    if run is None:
+        yield
+        return
+    with run.stage(name):
+        yield
+
+
+def payload(name, obj):
+    """Record the payload size of the element `obj` under `name` and return `obj` unchanged."""
+    run = current()
+    if run is not None:
+        run.payload(name, obj)
+    return obj
+
+
+@contextlib.contextmanager
+def waiting():
+    """Leave the rerun on this thread out of the recording runs while the block waits, e.g. for a background job.
+
+    A rerun blocked on a job allocates next to nothing itself, so the job's
+    stages are not marked concurrent just because the rerun waits for them.
+    """
+    run = current()
+    if run is None:
+        yield
+        return
+    with _runs_lock:
+        _active.discard(run)
+    try:
+        yield
+    finally:
+        with _runs_lock:
+            _active.add(run)
+
+
+def attach(run):
+    """Add the records of `run` to the rerun recording on this thread, if both exist."""
+    current_run = current()
+    if current_run is not None and run is not None:
+        current_run.attach(run)
+
+
+def finish(page, log=True):
+    """Stop recording the rerun of `page` on this thread and return it, logged as one JSON line if `log`."""
+    run = current()
+    if run is None:
+        return None
+    _local.run = None
+    with _runs_lock:
+        _active.discard(run)
+    run.page = page
+    run.seconds = round(time.perf_counter() - run._start, 6)
+    if not log:
+        return run
+    logger.info(json.dumps({'timestamp': datetime.datetime.fromtimestamp(run.started).isoformat(timespec='seconds'),
+                            'session': run.session, 'page': page, 'seconds': run.seconds,
+                            'records': run.records}))
+    return run
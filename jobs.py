@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+
+import instrument
+
+MAX_WORKERS = 4
+# finished jobs kept for reruns asking for the same results, least recently used first
+MAX_FINISHED = 64
+
+
+class Cancelled(Exception):
+    """Raised inside a job once no session waits for its result any more."""
+
+
+class Job:
+    """One page computation running on the background executor.
+
+    Cancellation is cooperative and coarse: a running job only stops at its
+    next report(), so one cancelled inside a long step (loading the daily
+    cube, building or querying the correlation engine) still runs that step
+    to the end; only the steps after it are skipped.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.progress = 0.0
+        self.message = ''
+        # sessions waiting for the result, the job is cancelled when the last one leaves
+        self.sessions = set()
+        self.future = None
+        # stages recorded on the job's thread when profiling is on (see instrument), attached by waiting reruns
+        self.profile = None
+        self._cancel = threading.Event()
+
+    def report(self, progress, message=''):
+        """Record how far the job got (0 to 1); raises Cancelled once the job was cancelled."""
+        if self._cancel.is_set():
+            raise Cancelled(f"job {self.key!r} was cancelled")
+        self.progress, self.message = progress, message
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        # a job that did not start yet is dropped, a running one stops at its next report()
+        self._cancel.set()
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def failed(self):
+        return self.future.done() and (self.future.cancelled() or self.future.exception() is not None)
+
+    def wait(self, timeout=None):
+        """Wait up to `timeout` seconds for the job; return whether it is done."""
+        try:
+            self.future.exception(timeout)
+        except TimeoutError:
+            return False
+        except CancelledError:
+            pass
+        return True
+
+    def result(self):
+        return self.future.result()
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='page-job')
+# key -> Job, running jobs and the MAX_FINISHED most recently used finished ones
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+def job_key(page, params):
+    return page, tuple(sorted(params.items()))
+
+
+def _run(job, func, params):
+    instrument.start()
+    try:
+        job.report(0.0)
+        with instrument.stage(job.key[0]):
+            result = func(job, **params)
+    finally:
+        job.profile = instrument.finish(job.key[0], log=False)
+    job.progress = 1.0
+    return result
+
+
+def submit(page, params, func, session=None):
+    """Return the job computing `func(job, **params)` for `page`, starting it unless it is already known.
+
+    Requests for the same (page, params) share one job, whether it is still
+    running or already finished; cancelled and failed jobs are started again.
+    `params` must be hashable values, e.g. include the data version so results
+    of older data are not served.
+    """
+    key = job_key(page, params)
+    with _lock:
+        job = _jobs.get(key)
+        if job is None or job.cancelled or job.failed():
+            job = Job(key)
+            job.future = _executor.submit(_run, job, func, params)
+            _jobs[key] = job
+        _jobs.move_to_end(key)
+        if session is not None:
+            job.sessions.add(session)
+        finished = [k for k, j in _jobs.items() if j.done()]
+        for old in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del _jobs[old]
+    return job
+
+
+def release(session, keep=()):
+    """Stop waiting on behalf of `session` for every job but `keep`; cancel the jobs nobody waits for."""
+    cancelled = []
+    with _lock:
+        for key, job in list(_jobs.items()):
+            if session not in job.sessions or key in keep:
+                continue
+            job.sessions.discard(session)
+            if not job.sessions and not job.done():
+                job.cancel()
+                del _jobs[key]
+                cancelled.append(key)
+    return cancelled
+
+
+def running():
+    """Return the (key, progress, message) of the jobs that did not finish yet."""
+    with _lock:
+        return [(key, job.progress, job.message) for key, job in _jobs.items() if not job.done()]
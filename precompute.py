@@ -0,0 +1,171 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from aggregates import build_daily_cube, build_participant_table, read_daily_cube, write_daily_cube, \
+    write_participant_table
+from analytics import PANAS_COLUMNS, weekday_profile
+from data_store import DATA_PATH, data_version, load_dataframe, load_source_frame
+from export import FORMATS, write_export
+from schema import PARTICIPANT_COLUMNS, SENSOR_COLUMNS
+
+# bumped when the files or their layout change, older artifact directories are then ignored
+ARTIFACT_VERSION = 2
+MANIFEST = 'manifest.json'
+
+# (path, name) -> (data version, loaded artifact)
+_loaded = {}
+_lock = threading.Lock()
+
+
+def artifacts_dir(path=DATA_PATH):
+    return path + '.artifacts'
+
+
+def _daily_cube(frame, dst):
+    write_daily_cube(build_daily_cube(frame), dst)
+
+
+def _panas_profile(frame, dst):
+    weekday_profile.__wrapped__(frame, tuple(PANAS_COLUMNS)).to_parquet(dst, engine='pyarrow')
+
+
+def _participants(frame, dst):
+    write_participant_table(build_participant_table(frame), dst)
+
+
+def _export(fmt):
+    def write(frame, dst):
+        with open(dst, 'wb') as f:
+            write_export(frame, fmt, f)
+    return write
+
+
+def _read_frame(src):
+    return pd.read_parquet(src, engine='pyarrow')
+
+
+# name -> (file name, columns it is computed from, function writing it, function reading it back)
+# exports are written from the stored frame (columns None, see data_store.load_source_frame) and served as
+# files, so they have no reader
+ARTIFACTS = {
+    'daily_cube': ('daily_cube.parquet', ['date'] + SENSOR_COLUMNS, _daily_cube, read_daily_cube),
+    'panas_profile': ('panas_profile.parquet', ['DayName'] + list(PANAS_COLUMNS), _panas_profile, _read_frame),
+    'participants': ('participants.parquet', ['id'] + PARTICIPANT_COLUMNS, _participants, _read_frame),
+    **{f'export.{fmt}': (f'export.{ext}', None, _export(fmt), None) for fmt, (ext, _) in FORMATS.items()},
+}
+
+
+def _materialize(name, frame, out_dir):
+    # runs in a worker process
+    file_name, _, write, _ = ARTIFACTS[name]
+    start = time.perf_counter()
+    write(frame, os.path.join(out_dir, file_name))
+    return name, time.perf_counter() - start
+
+
+def precompute(path=DATA_PATH, names=None, workers=None):
+    """Compute the artifacts `names` (all by default) of the data at `path` into a versioned directory.
+
+    The frame is loaded once and every artifact is computed in a process pool.
+    Files are written to a temporary directory that is renamed to
+    `artifacts_dir(path)/<data version>` when all of them are done, so the app
+    never sees a partial set. Returns that directory.
+    """
+    names = list(ARTIFACTS) if names is None else list(names)
+    version = data_version(path)
+    frame = load_dataframe(path=path)
+    source = load_source_frame(path) if any(ARTIFACTS[name][1] is None for name in names) else None
+    root = artifacts_dir(path)
+    out_dir = os.path.join(root, version)
+    tmp = f"{out_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_materialize, name, source if ARTIFACTS[name][1] is None else
+                                   frame[ARTIFACTS[name][1]], tmp) for name in names]
+            seconds = dict(future.result() for future in futures)
+        manifest = {'artifact_version': ARTIFACT_VERSION, 'data_version': version,
+                    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'artifacts': {name: {'file': ARTIFACTS[name][0], 'seconds': round(seconds[name], 3)}
+                                  for name in names}}
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        os.replace(tmp, out_dir)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out_dir
+
+
+def prune(path=DATA_PATH, keep=2):
+    """Delete all but the `keep` most recent artifact directories of `path`."""
+    root = artifacts_dir(path)
+    if not os.path.isdir(root):
+        return []
+    dirs = sorted((os.path.join(root, name) for name in os.listdir(root)
+                   if os.path.exists(os.path.join(root, name, MANIFEST))), key=os.path.getmtime, reverse=True)
+    for old in dirs[keep:]:
+        shutil.rmtree(old)
+    return dirs[keep:]
+
+
+def _manifest(path):
+    manifest = os.path.join(artifacts_dir(path), data_version(path), MANIFEST)
+    try:
+        with open(manifest) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('artifact_version') == ARTIFACT_VERSION else None
+
+
+def artifact_path(name, path=DATA_PATH):
+    """Return the file of artifact `name` precomputed for the current data at `path`, or None."""
+    manifest = _manifest(path)
+    if manifest is None or name not in manifest['artifacts']:
+        return None
+    return os.path.join(artifacts_dir(path), manifest['data_version'], manifest['artifacts'][name]['file'])
+
+
+def load_artifact(name, fallback, path=DATA_PATH):
+    """Return artifact `name` of the current data at `path`, or `fallback()` when it was not precomputed.
+
+    Loaded artifacts stay cached per process until the data changes and are
+    shared between sessions, so they must not be modified.
+    """
+    version = data_version(path)
+    with _lock:
+        cached = _loaded.get((path, name))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    src = artifact_path(name, path)
+    if src is None:
+        return fallback()
+    value = ARTIFACTS[name][3](src)
+    with _lock:
+        _loaded[(path, name)] = (version, value)
+    return value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the results of every dashboard page for the app to serve.")
+    parser.add_argument('--data', default=DATA_PATH, help="data file to precompute (default: %(default)s)")
+    parser.add_argument('--only', nargs='+', choices=list(ARTIFACTS), help="artifacts to compute (default: all)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--keep', type=int, default=2, help="artifact directories to keep (default: %(default)s)")
+    args = parser.parse_args()
+    written = precompute(args.data, args.only, args.workers)
+    with open(os.path.join(written, MANIFEST)) as f:
+        for artifact, info in json.load(f)['artifacts'].items():
+            print(f"{artifact:16s} {info['seconds'] * 1000:8.1f} ms  {info['file']}")
+    prune(args.data, args.keep)
+    print(f"wrote {written}")
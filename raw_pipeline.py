@@ -0,0 +1,265 @@
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from aggregates import load_participant_table
+from data_store import DATA_PATH
+from schema import DERIVED_COLUMNS, NUMERIC_COLUMNS, PARTICIPANT_COLUMNS, SCHEMA, SENSOR_COLUMNS
+
+# bump when the daily values computed from the raw files change, every participant is then rebuilt
+PIPELINE_VERSION = 1
+MANIFEST = 'manifest.json'
+CHUNK_ROWS = 200000
+# the study's local time, raw timestamps are unix seconds
+TIMEZONE = 'America/New_York'
+# an inference counts for the time until the next one, gaps longer than this are time without sensing
+MAX_GAP = 300
+# one row per meal of a day, not computed from the raw files but carried over from the current frame
+DINING_COLUMNS = ['dinning_time', 'dinning_place', 'meal']
+
+# raw file of every participant ({uid} is u00, u01, ...) relative to the dataset root, and how it becomes daily columns:
+#   inference: hours per day spent in each inferred class
+#   interval:  hours per day of the (start, end) episodes, counted on the day they start
+#   level:     mean value per day
+#   total:     sum of a value per day, times `scale`
+#   count:     rows per day
+SOURCES = {
+    'audio': {'pattern': 'sensing/audio/audio_{uid}.csv', 'kind': 'inference', 'time': 'timestamp',
+              'value': 'audio inference',
+              'classes': {0: 'silence (in hours)', 1: 'voice (in hours)', 2: 'noise (in hours)'}},
+    'activity': {'pattern': 'sensing/activity/activity_{uid}.csv', 'kind': 'inference', 'time': 'timestamp',
+                 'value': 'activity inference',
+                 'classes': {0: 'stationary (in hours)', 1: 'walking (in hours)', 2: 'running (in hours)'}},
+    'conversation': {'pattern': 'sensing/conversation/conversation_{uid}.csv', 'kind': 'interval',
+                     'start': 'start_timestamp', 'end': 'end_timestamp', 'column': 'conversation_duration_in_hours'},
+    'dark': {'pattern': 'sensing/dark/dark_{uid}.csv', 'kind': 'interval', 'start': 'start', 'end': 'end',
+             'column': 'dark_duration_in_hours'},
+    'phonecharge': {'pattern': 'sensing/phonecharge/phonecharge_{uid}.csv', 'kind': 'interval', 'start': 'start',
+                    'end': 'end', 'column': 'phonecharge_duration_in_hours'},
+    'phonelock': {'pattern': 'sensing/phonelock/phonelock_{uid}.csv', 'kind': 'interval', 'start': 'start',
+                  'end': 'end', 'column': 'phonelock_duration_in_hours'},
+    'bluetooth': {'pattern': 'sensing/bluetooth/bt_{uid}.csv', 'kind': 'level', 'time': 'time', 'value': 'level',
+                  'column': 'bluetooth_level'},
+    'wifi': {'pattern': 'sensing/wifi/wifi_{uid}.csv', 'kind': 'level', 'time': 'time', 'value': 'level',
+             'column': 'wifi_level'},
+    'calls': {'pattern': 'call_log/call_log_{uid}.csv', 'kind': 'total', 'time': 'timestamp',
+              'value': 'CALLS_duration', 'scale': 1 / 60, 'column': 'CALLS_duration_in_minutes'},
+    'sms': {'pattern': 'sms/sms_{uid}.csv', 'kind': 'count', 'time': 'timestamp', 'column': 'sms_count'},
+}
+
+PANAS_SURVEY = 'survey/panas.csv'
+PANAS_ITEMS = {
+    'label_panas_PA': ['Interested', 'Strong', 'Enthusiastic', 'Proud', 'Alert', 'Inspired', 'Determined',
+                       'Attentive', 'Active', 'Excited'],
+    'label_panas_NA': ['Distressed', 'Upset', 'Guilty', 'Scared', 'Hostile', 'Irritable', 'Ashamed', 'Nervous',
+                       'Jittery', 'Afraid'],
+}
+
+
+def _read_chunks(path):
+    # raw StudentLife headers have spaces after the commas
+    for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS, skipinitialspace=True):
+        chunk.columns = chunk.columns.str.strip()
+        yield chunk
+
+
+def _days(seconds):
+    return pd.to_datetime(seconds, unit='s', utc=True).dt.tz_convert(TIMEZONE).dt.tz_localize(None).dt.normalize()
+
+
+def _inference(path, spec):
+    time, value, parts = spec['time'], spec['value'], []
+    pending = None
+    for chunk in _read_chunks(path):
+        chunk = chunk[[time, value]] if pending is None else pd.concat([pending, chunk[[time, value]]],
+                                                                        ignore_index=True)
+        # the last inference of a chunk lasts until the first one of the next chunk
+        pending = chunk.iloc[-1:]
+        seconds = (chunk[time].shift(-1) - chunk[time]).clip(0, MAX_GAP).iloc[:-1]
+        rows = chunk.iloc[:-1]
+        parts.append(seconds.groupby([_days(rows[time]), rows[value]]).sum())
+    if not parts:
+        return pd.DataFrame(columns=list(spec['classes'].values()), dtype='float64')
+    seconds = pd.concat(parts).groupby(level=[0, 1]).sum().unstack(fill_value=0)
+    return (seconds.reindex(columns=list(spec['classes']), fill_value=0) / 3600).rename(columns=spec['classes'])
+
+
+def _interval(path, spec):
+    parts = [(chunk[spec['end']] - chunk[spec['start']]).clip(lower=0).groupby(_days(chunk[spec['start']])).sum()
+             for chunk in _read_chunks(path)]
+    hours = pd.concat(parts).groupby(level=0).sum() / 3600 if parts else pd.Series(dtype='float64')
+    return hours.to_frame(spec['column'])
+
+
+def _level(path, spec):
+    parts = [chunk[spec['value']].groupby(_days(chunk[spec['time']])).agg(['sum', 'count'])
+             for chunk in _read_chunks(path)]
+    if not parts:
+        return pd.DataFrame(columns=[spec['column']], dtype='float64')
+    totals = pd.concat(parts).groupby(level=0).sum()
+    return (totals['sum'] / totals['count']).to_frame(spec['column'])
+
+
+def _total(path, spec):
+    parts = [chunk[spec['value']].groupby(_days(chunk[spec['time']])).sum() for chunk in _read_chunks(path)]
+    total = pd.concat(parts).groupby(level=0).sum() * spec.get('scale', 1) if parts else pd.Series(dtype='float64')
+    return total.to_frame(spec['column'])
+
+
+def _count(path, spec):
+    parts = [chunk.groupby(_days(chunk[spec['time']])).size() for chunk in _read_chunks(path)]
+    count = pd.concat(parts).groupby(level=0).sum() if parts else pd.Series(dtype='int64')
+    return count.to_frame(spec['column'])
+
+
+REDUCERS = {'inference': _inference, 'interval': _interval, 'level': _level, 'total': _total, 'count': _count}
+
+
+def participant_files(root, uid):
+    """Return the raw files of participant `uid` under `root`, by source name."""
+    files = {name: os.path.join(root, spec['pattern'].format(uid=uid)) for name, spec in SOURCES.items()}
+    return {name: path for name, path in files.items() if os.path.exists(path)}
+
+
+def find_participants(root):
+    """Return the uids (u00, u01, ...) that have at least one raw file under `root`."""
+    uids = set()
+    for spec in SOURCES.values():
+        pattern = spec['pattern'].format(uid='*')
+        regex = re.compile(re.escape(spec['pattern']).replace(re.escape('{uid}'), r'(u\d+)') + '$')
+        for path in glob.glob(os.path.join(root, pattern)):
+            match = regex.search(os.path.relpath(path, root).replace(os.sep, '/'))
+            if match:
+                uids.add(match.group(1))
+    return sorted(uids)
+
+
+def process_participant(root, uid):
+    """Reduce the raw files of participant `uid` to one row per day with the SENSOR_COLUMNS.
+
+    Files are read CHUNK_ROWS rows at a time, so memory does not grow with their size.
+    """
+    daily = [REDUCERS[SOURCES[name]['kind']](path, SOURCES[name]) for name, path in participant_files(root, uid).items()]
+    frame = pd.concat(daily, axis=1) if daily else pd.DataFrame()
+    frame = frame.reindex(columns=SENSOR_COLUMNS).astype('float64').sort_index()
+    return frame.rename_axis('date').reset_index().assign(id=int(uid[1:]))
+
+
+def _fingerprint(root, uid):
+    files = participant_files(root, uid)
+    return {'pipeline_version': PIPELINE_VERSION,
+            'files': {os.path.relpath(path, root): [os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                      for path in sorted(files.values())}}
+
+
+def panas_scores(path, survey_type='post'):
+    """Return the PANAS positive and negative affect scores per participant id from the raw survey at `path`."""
+    survey = pd.read_csv(path, skipinitialspace=True)
+    survey.columns = survey.columns.str.strip()
+    survey = survey[survey['type'].str.strip() == survey_type]
+    scores = pd.DataFrame({label: survey[items].sum(axis=1, min_count=len(items)) for label, items in PANAS_ITEMS.items()})
+    scores.index = survey['uid'].str.strip().str[1:].astype('int64')
+    return scores.groupby(level=0).mean()
+
+
+def _participant_scores(root, out, scores, survey_type):
+    if scores is not None:
+        table = pd.read_parquet(scores) if scores.endswith('.parquet') else pd.read_csv(scores)
+        table = table.set_index('id')
+    elif os.path.exists(out):
+        # keep the scores of the frame being rebuilt
+        table = load_participant_table(out)
+    else:
+        table = pd.DataFrame(columns=PARTICIPANT_COLUMNS)
+    table.index = table.index.astype('int64')
+    if os.path.exists(os.path.join(root, PANAS_SURVEY)):
+        panas = panas_scores(os.path.join(root, PANAS_SURVEY), survey_type)
+        table = panas.combine_first(table.drop(columns=list(PANAS_ITEMS), errors='ignore'))
+    return table.reindex(columns=PARTICIPANT_COLUMNS)
+
+
+def _dining_rows(out):
+    # the meals of the frame being rebuilt, one row each, keyed on (id, date)
+    if not os.path.exists(out):
+        return pd.DataFrame(columns=['id', 'date'] + DINING_COLUMNS)
+    frame = pd.read_pickle(out)
+    meals = frame[['id', 'date'] + DINING_COLUMNS].dropna(subset=DINING_COLUMNS, how='all')
+    return meals.astype({'id': 'int64'}).sort_values(['id', 'date'], kind='stable')
+
+
+def _as_stored(frame):
+    # the pickle keeps full precision and plain dtypes, load_dataframe casts it to SCHEMA when it reads it
+    frame = frame.reindex(columns=[col for col in SCHEMA if col not in DERIVED_COLUMNS])
+    frame[NUMERIC_COLUMNS] = frame[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce').astype('float64')
+    return frame.astype({'id': 'int64', 'date': 'datetime64[ns]'})
+
+
+def build_frame(root, out=DATA_PATH, workers=None, scores=None, survey_type='post', force=False):
+    """Rebuild the daily frame at `out` from the raw StudentLife dataset at `root`.
+
+    Participants are processed in parallel processes and their daily rows kept
+    in `out + '.raw'`; a rerun only processes the participants whose raw files
+    (size and mtime) changed since. Per-participant scores come from `scores`
+    (a csv or parquet file with an id column) or from the current frame at
+    `out`; PANAS is scored from the raw survey when it is present. The meals
+    (dinning_time, dinning_place, meal) of the current frame are kept, one row
+    per meal like in the original frame. An existing frame at `out` is only
+    replaced with `force`. Returns the uids that were processed.
+    """
+    if os.path.exists(out) and not force:
+        raise FileExistsError(f"{out} exists, pass force=True (--force) to rebuild it")
+    cache = out + '.raw'
+    os.makedirs(cache, exist_ok=True)
+    manifest_path = os.path.join(cache, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    uids = find_participants(root)
+    fingerprints = {uid: _fingerprint(root, uid) for uid in uids}
+    todo = [uid for uid in uids if manifest.get(uid) != fingerprints[uid]
+            or not os.path.exists(os.path.join(cache, f'{uid}.parquet'))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for uid, daily in zip(todo, pool.map(process_participant, [root] * len(todo), todo)):
+            daily.to_parquet(os.path.join(cache, f'{uid}.parquet'), engine='pyarrow', index=False)
+            manifest[uid] = fingerprints[uid]
+    for uid in set(manifest) - set(uids):
+        # raw files of this participant were removed
+        del manifest[uid]
+        os.remove(os.path.join(cache, f'{uid}.parquet'))
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+
+    daily = pd.concat([pd.read_parquet(os.path.join(cache, f'{uid}.parquet'), engine='pyarrow') for uid in uids],
+                      ignore_index=True)
+    frame = daily.join(_participant_scores(root, out, scores, survey_type), on='id')
+    # days with meals get one row per meal, the other days a single row without one
+    frame = frame.sort_values(['id', 'date']).merge(_dining_rows(out), on=['id', 'date'], how='left')
+    frame = _as_stored(frame.reset_index(drop=True))
+    tmp = out + '.tmp'
+    frame.to_pickle(tmp)
+    os.replace(tmp, out)
+    return todo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build data/dataframe from the raw StudentLife dataset.")
+    parser.add_argument('root', help="directory of the extracted dataset (with sensing/, call_log/, sms/, survey/)")
+    parser.add_argument('--out', default=DATA_PATH, help="daily frame to write (default: %(default)s)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--scores', help="csv or parquet file with per-participant scores and an id column "
+                                         "(default: the scores of the current --out frame)")
+    parser.add_argument('--panas-survey', default='post', choices=['pre', 'post'],
+                        help="PANAS survey round used for the affect scores (default: %(default)s)")
+    parser.add_argument('--force', action='store_true', help="replace the frame at --out if it exists")
+    args = parser.parse_args()
+    processed = build_frame(args.root, args.out, args.workers, args.scores, args.panas_survey, args.force)
+    print(f"processed {len(processed)} participant(s): {' '.join(processed) or 'none changed'}; wrote {args.out}")
@@ -0,0 +1,68 @@
+import pandas as pd
+
+# bump when SCHEMA changes, so stored copies of the frame get rewritten
+SCHEMA_VERSION = 1
+
+# daily sensor measurements, one value per participant and day
+SENSOR_COLUMNS = ['stationary (in hours)', 'walking (in hours)', 'running (in hours)',
+                  'silence (in hours)', 'voice (in hours)', 'noise (in hours)',
+                  'conversation_duration_in_hours', 'bluetooth_level', 'dark_duration_in_hours',
+                  'phonecharge_duration_in_hours', 'phonelock_duration_in_hours', 'wifi_level',
+                  'CALLS_duration_in_minutes', 'sms_count']
+
+# academic performance and questionnaire scores
+SCORE_COLUMNS = ['gpa all', 'gpa 13s', 'gpa cs 65', 'piazza_days_online', 'piazza_views',
+                 'piazza_contributions', 'piazza_questions', 'piazza_notes', 'piazza_answers',
+                 'label_fsScore', 'label_panas_PA', 'label_panas_NA', 'label_extraversion',
+                 'label_agreeableness', 'label_conscientiousness', 'label_neuroticism', 'label_openness',
+                 'label_loneliness', 'label_pss_score', 'label_phq_score']
+
+NUMERIC_COLUMNS = SENSOR_COLUMNS + SCORE_COLUMNS
+
+# scores measured once per participant, repeated on each of their daily rows
+PARTICIPANT_COLUMNS = SCORE_COLUMNS
+
+# columns normalize() derives from the stored ones
+DERIVED_COLUMNS = ['DayName']
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+DAY_NAME_TYPE = pd.CategoricalDtype(DAY_NAMES, ordered=True)
+
+# declared dtype of every column of the StudentLife frame
+SCHEMA = {
+    'id': 'category',
+    'date': 'datetime64[ns]',
+    **{col: 'float32' for col in NUMERIC_COLUMNS},
+    'dinning_time': 'object',
+    'dinning_place': 'category',
+    'meal': 'category',
+}
+
+
+def normalize(frame):
+    """Cast `frame` to SCHEMA and add the ordered `DayName` column.
+
+    Returns the normalized frame and a dict with, per column, the number of
+    values that could not be coerced and were replaced by NaN/NaT (only
+    columns with failures are listed) and the declared columns that are missing.
+    """
+    frame = frame.copy()
+    failures = {}
+    missing = [col for col in SCHEMA if col not in frame.columns]
+    for col, dtype in SCHEMA.items():
+        if col not in frame.columns:
+            continue
+        values = frame[col]
+        if dtype == 'float32':
+            values = pd.to_numeric(values, errors='coerce').astype('float32')
+        elif dtype == 'datetime64[ns]':
+            values = pd.to_datetime(values.astype("str"), format='%Y-%m-%d', errors='coerce').astype(dtype)
+        else:
+            values = values.astype(dtype)
+        failed = int((values.isna() & frame[col].notna()).sum())
+        if failed:
+            failures[col] = failed
+        frame[col] = values
+    if 'date' in frame.columns:
+        frame['DayName'] = frame['date'].dt.day_name().astype(DAY_NAME_TYPE)
+    return frame, {'failures': failures, 'missing': missing}
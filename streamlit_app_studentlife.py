@@ -4,7 +4,49 @@ from streamlit_option_menu import option_menu
 import pandas as pd
 import plotly.express as px
 import altair as alt
-from streamlit_extras.dataframe_explorer import dataframe_explorer
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import instrument
+import jobs
+from aggregates import load_daily_cube, load_participant_table
+from analytics import PANAS_COLUMNS, daily_means_long, daily_series, overall_mean, participant_daily_long, \
+    trait_scores_long, weekday_profile
+from correlations import MAX_LAG, load_correlations
+from data_store import data_version, load_dataframe, load_source_frame
+from downsample import CHART_WIDTH, downsample_long, downsample_series
+from export import FORMATS, export_file_name, get_export, prepare_export, prepare_file_export
+from precompute import artifact_path, load_artifact
+from schema import DAY_NAMES
+from table_query import PAGE_SIZES, load_participant_index, load_table_index
+
+# opt-in stage timings of this rerun (STUDENTLIFE_PROFILE=1), shown in the sidebar and logged
+run_ctx = get_script_run_ctx()
+session_id = run_ctx.session_id if run_ctx else None
+instrument.start(session=session_id)
+
+# keys of the background jobs this rerun waited for, the session's other jobs are released at the end
+requested_jobs = []
+
+
+def page_result(page, func, **params):
+    # computed on the background executor: reruns and sessions asking for the same (page, params) share
+    # the job, and a rerun interrupted by a widget change leaves it running instead of losing the work
+    # this rerun only waits meanwhile, it does not count as a run overlapping the job's stages
+    with instrument.waiting():
+        job = jobs.submit(page, params, func, session=session_id)
+        requested_jobs.append(job.key)
+        computed = not job.done()
+        if not job.wait(0.05):
+            bar = st.progress(0.0, text="Computing...")
+            while not job.wait(0.1):
+                bar.progress(job.progress, text=job.message or "Computing...")
+            bar.empty()
+        result = job.result()
+    if computed:
+        # the stages the job recorded on its own thread, under the stage of this rerun that waited for it
+        instrument.attach(job.profile)
+    return result
+
 
 # format page (browser, logo, title, )
 st.set_page_config(layout="wide", page_title="StudentLife Web Interface",
@@ -48,22 +90,70 @@ if choose == "Data Descriptor":
     st.markdown("""
         ### The dataset's table
         """)
-    df = pd.read_pickle('data/dataframe')
-    filtered_df = dataframe_explorer(df, case=False)
-    st.dataframe(filtered_df)
+    with instrument.stage('data_descriptor.load'):
+        # filtering, sorting and paging run here on the server, only the visible page is sent to the browser
+        table = load_table_index()
+    table_columns = [c for c in table.frame.columns if c not in ('id', 'date')]
+    table_ids = st.multiselect("Participants", table.ids)
+    first_date, last_date = table.filter_kinds['date'][1]
+    table_dates = st.date_input("Dates", value=(first_date, last_date), min_value=first_date, max_value=last_date)
+    table_filters = {}
+    for column in st.multiselect("Filter dataframe on", table_columns):
+        left, right = st.columns((1, 20))
+        left.write("↳")
+        kind, values = table.filter_kinds[column]
+        if kind == 'in':
+            table_filters[column] = right.multiselect(f"Values for {column}", values, default=values)
+        elif kind == 'range':
+            table_filters[column] = right.slider(f"Values for {column}", values[0], values[1], values,
+                                                 step=(values[1] - values[0]) / 100 or None)
+        elif kind == 'dates':
+            table_filters[column] = right.date_input(f"Values for {column}", value=values)
+        else:
+            table_filters[column] = right.text_input(f"Pattern in {column}")
+
+    col1, col2, col3 = st.columns(3)
+    sort_by = col1.selectbox("Sort by", ['id', 'date'] + table_columns)
+    ascending = col2.radio("Order", ["Ascending", "Descending"], horizontal=True) == "Ascending"
+    page_size = col3.selectbox("Rows per page", PAGE_SIZES, 1)
+    with instrument.stage('data_descriptor.query'):
+        table_rows = table.select(ids=table_ids, date_range=table_dates if len(table_dates) == 2 else None,
+                                  filters=table_filters, sort_by=sort_by, ascending=ascending, case=False)
+    page_count = max(1, -(-len(table_rows) // page_size))
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1) - 1
+    page_df = table_rows.iloc[page * page_size:(page + 1) * page_size]
+    with instrument.stage('data_descriptor.send_table'):
+        st.dataframe(instrument.payload('data_descriptor.table', page_df))
+    st.caption(f"Rows {min(page * page_size + 1, len(table_rows))}-{page * page_size + len(page_df)} of {len(table_rows)}")
 
     st.write("""
         ### Download data
-        You can download the above data in a csv file.
+        You can download the above data as csv, gzip-compressed csv or parquet file.
         """)
 
-    def convert_df(df):
-        # IMPORTANT: Cache the conversion to prevent computation on every rerun
-        return df.to_csv().encode('utf-8')
-
-    data_csv = convert_df(df)
-
-    st.download_button(label="StudentLife", data=data_csv, file_name="StudentLife_dataframe.csv", mime='text/csv')
+    export_format = st.selectbox("File format:", list(FORMATS), 0)
+    export_filtered = st.checkbox("Only the rows matching the table filters")
+
+    # the file is built on request only and cached by content, so reruns and identical
+    # requests from other sessions do not serialize the frame again
+    export_key = st.session_state.get('export_key')
+    if st.button("Prepare download"):
+        # the full table is served from the precomputed file when precompute.py ran for this data
+        export_file = None if export_filtered else artifact_path(f'export.{export_format}')
+        with instrument.stage('data_descriptor.export'):
+            if export_file is not None:
+                export_key = prepare_file_export(export_file, export_format)
+            else:
+                # exported from the stored frame, at its original precision and without the derived DayName
+                source = load_source_frame()
+                export_key = prepare_export(source.loc[table_rows.index] if export_filtered else source,
+                                            export_format)
+        st.session_state['export_key'] = export_key
+    export_data = get_export(export_key) if export_key is not None else None
+    if export_data is not None:
+        st.download_button(label="StudentLife", data=export_data,
+                           file_name=export_file_name("StudentLife_dataframe", export_key[1]),
+                           mime=FORMATS[export_key[1]][1])
 
     # change button css
     st.markdown(
@@ -113,15 +203,31 @@ if choose == "Demographics":
     st.markdown('\n')
 
 if choose == "Interactive visualizations":
+    version = data_version()
+
+    def load_cube_job(job, version):
+        job.report(0.1, "Loading the daily aggregates")
+        return load_artifact('daily_cube', load_daily_cube)
 
-    df = pd.read_pickle('data/dataframe')
-    df['date'] = pd.to_datetime(df['date'].astype("str"), format='%Y-%m-%d')
-    selected = option_menu(None, ["Behavior Patterns", "Exercise", 'Self-reports'], menu_icon="cast",
+    def daily_series_job(job, variable, date_range, version):
+        cube = load_cube_job(job, version)
+        job.report(0.6, f"Resampling {variable}")
+        series = daily_series(cube, variable, version=version).loc[pd.Timestamp(date_range[0]):pd.Timestamp(date_range[1])]
+        return downsample_series(series, CHART_WIDTH)
+
+    selected = option_menu(None, ["Behavior Patterns", "Exercise", 'Self-reports', 'Participants', 'Correlations'],
+                           menu_icon="cast",
                            default_index=0, orientation="horizontal")
 
     if selected == "Behavior Patterns":
+        # per-date aggregates of every sensor column, precomputed next to the data
+        with instrument.stage('behavior_patterns.load_cube'):
+            cube = page_result('daily_cube', load_cube_job, version=version)
 
         st.markdown(""" ## Behavior Patterns """)
+        # narrowing the range re-samples the charts at a finer level, the browser only gets ~CHART_WIDTH points
+        first_day, last_day = cube.index.min().date(), cube.index.max().date()
+        date_range = st.slider("Date range", first_day, last_day, (first_day, last_day), format="DD MMM YYYY")
         st.markdown("""
                                    ### Sound Surroundings 
                                    """)
@@ -138,27 +244,15 @@ if choose == "Interactive visualizations":
         st.markdown(info_hr, unsafe_allow_html=True)
         st.markdown('\n')
 
-        df['silence (in hours)'] = df['silence (in hours)'].apply(pd.to_numeric, errors='coerce')
-        df['voice (in hours)'] = df['voice (in hours)'].apply(pd.to_numeric, errors='coerce')
-        df['noise (in hours)'] = df['noise (in hours)'].apply(pd.to_numeric, errors='coerce')
-
-
         col1, col2 = st.columns([1, 2])
         col1.markdown('**Select data to preview**')
         category = col1.radio("Select variable:", ["silence (in hours)", "voice (in hours)", "noise (in hours)"])
 
-        # Filter the data based on the selected variable
-        if category == "silence (in hours)":
-            filtered_data = df[["date", "silence (in hours)"]]
-        if category == "voice (in hours)":
-            filtered_data = df[["date", "voice (in hours)"]]
-        if category == "noise (in hours)":
-            filtered_data = df[["date", "noise (in hours)"]]
-
-        #st.write(filtered_data)
-
-        mean_per_day = filtered_data.groupby("date")[category].mean()
-        col2.line_chart(mean_per_day)
+        with instrument.stage('behavior_patterns.sound_series'):
+            mean_per_day = page_result('behavior_patterns.series', daily_series_job, variable=category,
+                                       date_range=date_range, version=version)
+        with instrument.stage('behavior_patterns.send_sound_chart'):
+            col2.line_chart(instrument.payload('behavior_patterns.sound_chart', mean_per_day))
 
         st.markdown("""
                         ### Conversation Daily Trends
@@ -173,27 +267,23 @@ if choose == "Interactive visualizations":
         st.markdown(info_hr, unsafe_allow_html=True)
         st.markdown('\n')
 
-        df['conversation_duration_in_hours'] = df['conversation_duration_in_hours'].apply(pd.to_numeric, errors='coerce')
-        df['CALLS_duration_in_minutes'] = df['CALLS_duration_in_minutes'].apply(pd.to_numeric, errors='coerce')
-
         col1, col2 = st.columns([1, 2])
         col1.markdown('**Select data to preview**')
         category = col1.radio("Select variable:", ["conversation_duration_in_hours", "CALLS_duration_in_minutes"])
 
-        # Filter the data based on the selected variable
-        if category == "conversation_duration_in_hours":
-            filtered_data = df[["date", "conversation_duration_in_hours"]]
-        if category == "CALLS_duration_in_minutes":
-            filtered_data = df[["date", "CALLS_duration_in_minutes"]]
-
-        # st.write(filtered_data)
-
-        mean_per_day = filtered_data.groupby("date")[category].mean()
-        col2.line_chart(mean_per_day)
+        with instrument.stage('behavior_patterns.conversation_series'):
+            mean_per_day = page_result('behavior_patterns.series', daily_series_job, variable=category,
+                                       date_range=date_range, version=version)
+        with instrument.stage('behavior_patterns.send_conversation_chart'):
+            col2.line_chart(instrument.payload('behavior_patterns.conversation_chart', mean_per_day))
 
 
     if selected == "Exercise":
+        with instrument.stage('exercise.load_cube'):
+            cube = page_result('daily_cube', load_cube_job, version=version)
         st.markdown(""" ## Exercise """)
+        first_day, last_day = cube.index.min().date(), cube.index.max().date()
+        date_range = st.slider("Date range", first_day, last_day, (first_day, last_day), format="DD MMM YYYY")
         st.markdown("""
                            ### Exercise Daily Pattern 
                            """)
@@ -204,22 +294,8 @@ if choose == "Interactive visualizations":
         plot_var_name = st.selectbox("Select variable to calculate its daily average value:", list(EXAMPLE_PLOT_VAR.keys()), 0)
         plot_var = EXAMPLE_PLOT_VAR[plot_var_name]
 
-        df['walking (in hours)'] = df['walking (in hours)'].astype(float)
-        df['running (in hours)'] = df['running (in hours)'].astype(float)
-
-        heartRate = df[['id', 'date', plot_var_name]]
-        heartRate_max = heartRate.groupby('date').agg({plot_var_name: 'max'})
-        heartRate_max.reset_index(inplace=True)
-        heartRate_max = heartRate_max.rename(columns={plot_var_name: 'Max', 'date': 'Date'})
-        heartRate_min = heartRate.groupby('date').agg({plot_var_name: 'min'})
-        heartRate_min = heartRate_min.rename(columns={plot_var_name: 'Min'})
-        heartRate_min.reset_index(inplace=True, drop=True)
-        heartRate_mean = round(heartRate.groupby('date').agg({plot_var_name: 'mean'}), 1)
-        heartRate_mean = heartRate_mean.rename(columns={plot_var_name: 'Mean'})
-        heartRate_mean.reset_index(inplace=True, drop=True)
-        heartRate_trend = pd.concat([heartRate_max, heartRate_min, heartRate_mean], axis=1)
-
-        all_mean = round(df[plot_var_name].mean(),2)
+        with instrument.stage('exercise.overall_mean'):
+            all_mean = round(overall_mean(cube, plot_var_name, version=version), 2)
 
         col1, col2, col3 = st.columns(3)
         col1.metric(label='Average hours per day',value=str(all_mean))
@@ -228,20 +304,11 @@ if choose == "Interactive visualizations":
         st.markdown(""" <style> .css-5rimss{font-size: 20px;} </style> """, unsafe_allow_html=True)
 
 
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values(by="date")
-        df['walking (in hours)'] = df['walking (in hours)'].astype(float)
-        df['running (in hours)'] = df['running (in hours)'].astype(float)
-
-        # Calculate the mean data for each date
-        df_mean = df.groupby('date').agg({
-            'walking (in hours)': 'mean',
-            'running (in hours)': 'mean'
-        }).reset_index()
-
-        df_long = df_mean.melt(id_vars=['date'],
-                               value_vars=['walking (in hours)', 'running (in hours)'],
-                               var_name='activity', value_name='hours')
+        with instrument.stage('exercise.trend'):
+            df_long = daily_means_long(cube, ('walking (in hours)', 'running (in hours)'),
+                                       var_name='activity', value_name='hours', version=version)
+            df_long = df_long[df_long['date'].between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))]
+            df_long = downsample_long(df_long, 'date', 'hours', 'activity', CHART_WIDTH)
 
         color_scale = alt.Scale(domain=['walking (in hours)', 'running (in hours)'],
                                 range=['#FFB6C1', '#CD5C5C'])
@@ -262,57 +329,20 @@ if choose == "Interactive visualizations":
                 '''
         st.markdown(info_hr, unsafe_allow_html=True)
         st.markdown('\n')
-        st.altair_chart(combined_chart, use_container_width=True)
+        with instrument.stage('exercise.send_chart'):
+            st.altair_chart(instrument.payload('exercise.chart', combined_chart), use_container_width=True)
 
     if selected == "Self-reports":
 
         st.markdown(""" ## Self-reported Data """)
 
-        df['date'] = pd.to_datetime(df['date'])
-        df['DayName'] = df['date'].dt.day_name()
-
-        summer_data = df[['id', 'DayName', 'label_panas_PA']].rename(columns={'label_panas_PA': 'panas_PA'})
-        winter_data = df[['id', 'DayName', 'label_panas_NA']].rename(columns={'label_panas_NA': 'panas_NA'})
-
-        sorted_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        summer_data['DayName'] = pd.Categorical(summer_data['DayName'], categories=sorted_days, ordered=True)
-        winter_data['DayName'] = pd.Categorical(winter_data['DayName'], categories=sorted_days, ordered=True)
-
-        # Define a function to calculate mean, min, and max values for each day
-        def calculate_aggregates(data, col):
-            grouped_data = data.groupby('DayName')[col]
-            mean_stress = grouped_data.mean().reset_index()
-            min_stress = grouped_data.min().reset_index()
-            max_stress = grouped_data.max().reset_index()
-            return mean_stress, min_stress, max_stress
-
-
-        # Calculate and merge aggregate values for both seasons
-        df1_mean, df1_min, df1_max = calculate_aggregates(summer_data, 'panas_PA')
-        summer_data = summer_data.merge(df1_mean, on='DayName', suffixes=('', '_mean'))
-        summer_data = summer_data.merge(df1_min, on='DayName', suffixes=('', '_min'))
-        summer_data = summer_data.merge(df1_max, on='DayName', suffixes=('', '_max'))
-        summer_data['PANAS'] = 'Positive Affect'
-
-        df2_mean, df2_min, df2_max = calculate_aggregates(winter_data, 'panas_NA')
-        winter_data = winter_data.merge(df2_mean, on='DayName', suffixes=('', '_mean'))
-        winter_data = winter_data.merge(df2_min, on='DayName', suffixes=('', '_min'))
-        winter_data = winter_data.merge(df2_max, on='DayName', suffixes=('', '_max'))
-        winter_data['PANAS'] = 'Negative Affect'
-
-        # Combine the two datasets and sort by day of the week
-        combined_df = pd.concat([summer_data, winter_data])
-        combined_df['DayName'] = pd.Categorical(combined_df['DayName'], categories=sorted_days, ordered=True)
-
-        sorted_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        combined_df['DayName'] = pd.Categorical(combined_df['DayName'], categories=sorted_days, ordered=True)
-        sorted_df = combined_df.sort_values(by='DayName')
-
-        summer_data['PANAS'] = 'Positive Affect'
-        winter_data['PANAS'] = 'Negative Affect'
-
-        #st.write(summer_data)
-        #st.write(winter_data)
+        # DayName is stored as an ordered categorical, Monday first
+        sorted_days = DAY_NAMES
+        # mean/min/max per day of the week, 7 rows per affect type
+        with instrument.stage('self_reports.panas'):
+            panas_profile = load_artifact('panas_profile', lambda: weekday_profile(
+                load_dataframe(['DayName'] + list(PANAS_COLUMNS)), tuple(PANAS_COLUMNS), version=version))
+            panas_profile = panas_profile.assign(PANAS=panas_profile['variable'].map(PANAS_COLUMNS))
 
         st.markdown(""" <style> .css-5rimss{font-size: 20px;} </style> """, unsafe_allow_html=True)
         # info section
@@ -327,44 +357,23 @@ if choose == "Interactive visualizations":
 
         scale = alt.Scale(domain=['Positive Affect', 'Negative Affect'], range=['#ffccb3', '#95d0c7'])
 
-        line_chart1 = alt.Chart(summer_data).mark_line(color='#ffccb3').encode(
+        line_chart = alt.Chart(panas_profile).mark_line().encode(
             x=alt.X('DayName:N', sort=sorted_days,
                     axis=alt.Axis(labelFontSize=15, titleFontSize=20, title='Day of the Week')),
-            y=alt.Y('panas_PA_mean:Q',
+            y=alt.Y('mean:Q',
                     axis=alt.Axis(labelFontSize=15, title='PANAS Scores', titleFontSize=20)),
-            # color='Season of the year:N',
-            color=alt.Color('PANAS:N', scale=scale),
-            tooltip=['DayName', 'panas_PA_mean', 'panas_PA_min', 'panas_PA_max']
-        )
-
-        confidence_interval1 = alt.Chart(summer_data).mark_area(opacity=0.3, color='#ffccb3').encode(
-            x=alt.X('DayName', axis=alt.Axis(labelFontSize=15), sort=sorted_days),
-            y='panas_PA_min',
-            y2='panas_PA_max'
-        )
-
-        line_chart2 = alt.Chart(winter_data).mark_line(color='#95d0c7').encode(
-            x=alt.X('DayName', axis=alt.Axis(labelFontSize=15), sort=sorted_days),
-            y='panas_NA_mean',
-            # color='Season of the year:N',
             color=alt.Color('PANAS:N', scale=scale),
-            tooltip=['DayName', 'panas_NA_mean', 'panas_NA_min', 'panas_NA_max']
+            tooltip=['DayName', 'PANAS', 'mean', 'min', 'max']
         )
 
-        confidence_interval2 = alt.Chart(winter_data).mark_area(opacity=0.3, color='#95d0c7').encode(
-            x=alt.X('DayName', axis=alt.Axis(labelFontSize=15), sort=sorted_days),
-            y='panas_NA_min',
-            y2='panas_NA_max'
-        )
-
-        # Combine the line charts and shaded confidence intervals into one interactive chart
-        combined_chart = (line_chart1 + line_chart2).properties(
+        combined_chart = line_chart.properties(
             width=800, height=400
         ).interactive().configure_legend(
             labelFontSize=20
         )
         # Show the interactive chart in Streamlit
-        st.altair_chart(combined_chart, use_container_width=True)
+        with instrument.stage('self_reports.send_panas_chart'):
+            st.altair_chart(instrument.payload('self_reports.panas_chart', combined_chart), use_container_width=True)
 
         st.markdown(""" <style> .css-5rimss{font-size: 20px;} </style> """, unsafe_allow_html=True)
         # info section
@@ -377,21 +386,11 @@ if choose == "Interactive visualizations":
         st.markdown(info_stai, unsafe_allow_html=True)
         st.markdown('\n')
 
-        df.columns = [col.replace('label_', '') for col in df.columns]
-
-        def plot_stacked_bar(df):
-            columns_to_stack = [
-                'extraversion',
-                'agreeableness',
-                'conscientiousness',
-                'neuroticism',
-                'openness',
-                'loneliness'
-            ]
-
-            # Melt the dataframe to have 'id' as identifier and stacked columns as values
-            df_melted = df.melt(id_vars=['id'], value_vars=columns_to_stack)
+        # id, variable, value rows of the six trait scores, one per participant and trait
+        with instrument.stage('self_reports.traits'):
+            df_melted = trait_scores_long(load_artifact('participants', load_participant_table), version=version)
 
+        def plot_stacked_bar(df_melted):
             chart = alt.Chart(df_melted).mark_bar().encode(
                 x='id:N',
                 y=alt.Y('value:Q', axis=alt.Axis(title='Score')),
@@ -405,21 +404,10 @@ if choose == "Interactive visualizations":
 
             return chart
 
-        st.write(plot_stacked_bar(df))
-
-        def plot_stacked_bar(df):
-            columns_to_stack = [
-                'extraversion',
-                'agreeableness',
-                'conscientiousness',
-                'neuroticism',
-                'openness',
-                'loneliness'
-            ]
-
-            # Melt the dataframe to have 'id' as identifier and stacked columns as values
-            df_melted = df.melt(id_vars=['id'], value_vars=columns_to_stack)
+        with instrument.stage('self_reports.send_trait_chart'):
+            st.write(instrument.payload('self_reports.trait_chart', plot_stacked_bar(df_melted)))
 
+        def plot_stacked_bar_by_trait(df_melted):
             chart = alt.Chart(df_melted).mark_bar().encode(
                 x=alt.X('variable:N', axis=alt.Axis(title='Personality Type')),
                 y=alt.Y('value:Q', axis=alt.Axis(title='Score')),
@@ -433,7 +421,94 @@ if choose == "Interactive visualizations":
 
             return chart
 
-        st.write(plot_stacked_bar(df))
+        with instrument.stage('self_reports.send_trait_totals_chart'):
+            st.write(instrument.payload('self_reports.trait_totals_chart', plot_stacked_bar_by_trait(df_melted)))
+
+    if selected == "Participants":
+        st.markdown(""" ## Participants """)
+        st.markdown(""" <style> .css-5rimss{font-size: 20px;} </style> """, unsafe_allow_html=True)
+        # info section
+        info_participants = '''
+                <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+                <i class="fa-solid fa-circle-info" style="color: #0e3f6e;"></i> Select one or more participants to follow
+                their daily sound surroundings, conversations, activity and PANAS scores.
+                '''
+        st.markdown(info_participants, unsafe_allow_html=True)
+        st.markdown('\n')
+
+        PARTICIPANT_VARIABLES = {
+            "Sound Surroundings": ("silence (in hours)", "voice (in hours)", "noise (in hours)"),
+            "Conversation": ("conversation_duration_in_hours", "CALLS_duration_in_minutes"),
+            "Activity": ("walking (in hours)", "running (in hours)"),
+            "PANAS": tuple(PANAS_COLUMNS),
+        }
+        # rows sorted by (id, date), so picking participants is a slice
+        with instrument.stage('participants.load_index'):
+            participants = load_participant_index([col for cols in PARTICIPANT_VARIABLES.values() for col in cols])
+        selected_ids = st.multiselect("Select participants:", participants.ids, default=participants.ids[:1])
+        participant_rows = participants.rows(selected_ids)
+
+        for title, variables in PARTICIPANT_VARIABLES.items():
+            st.markdown(f""" ### {title} """)
+            stage_name = f"participants.{title.lower().replace(' ', '_')}"
+            with instrument.stage(stage_name):
+                participant_long = participant_daily_long(participant_rows, variables, version=(version, tuple(selected_ids)))
+                # one line per participant and variable, each at most ~CHART_WIDTH points
+                participant_long = downsample_long(participant_long, 'date', 'value', ['id', 'variable'], CHART_WIDTH)
+            participant_chart = alt.Chart(participant_long).mark_line().encode(
+                x=alt.X('date:T', axis=alt.Axis(title='Date', format='%d %b %Y')),
+                y=alt.Y('value:Q', axis=alt.Axis(title=None)),
+                color=alt.Color('id:N', legend=alt.Legend(title='Participant')),
+                strokeDash=alt.StrokeDash('variable:N', legend=alt.Legend(title='Variable')),
+                tooltip=['id', 'date', 'variable', 'value']).interactive()
+            with instrument.stage(f'{stage_name}.send_chart'):
+                st.altair_chart(instrument.payload(f'{stage_name}.chart', participant_chart),
+                                use_container_width=True)
+
+    if selected == "Correlations":
+        st.markdown(""" ## Correlations """)
+        st.markdown(""" <style> .css-5rimss{font-size: 20px;} </style> """, unsafe_allow_html=True)
+        # info section
+        info_correlations = '''
+                <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+                <i class="fa-solid fa-circle-info" style="color: #0e3f6e;"></i> How the sensed behavior, the PANAS scores
+                and the personality traits vary together, either day by day within the participants or between the
+                participants' averages. A lag correlates each variable with the others a few days later.
+                '''
+        st.markdown(info_correlations, unsafe_allow_html=True)
+        st.markdown('\n')
+
+        # per-date sums are cached, so moving the date range does not touch the rows again
+        def correlations_job(job, version):
+            job.report(0.1, "Loading the participant-days")
+            return load_correlations()
+
+        def correlation_matrix_job(job, method, level, lag, date_range, variables, version):
+            correlations = correlations_job(job, version)
+            job.report(0.5, "Correlating")
+            return correlations.correlate(method, level, lag, date_range, variables)
+
+        with instrument.stage('correlations.load'):
+            correlations = page_result('correlations', correlations_job, version=version)
+        col1, col2, col3 = st.columns(3)
+        level = col1.radio("Level", ["Participant-daily", "Participant-aggregate"])
+        method = col2.radio("Method", ["Pearson", "Spearman"])
+        lag = col3.slider("Lag (days)", 0, MAX_LAG, 0) if level == "Participant-daily" else 0
+        first_day, last_day = correlations.dates.min().date(), correlations.dates.max().date()
+        date_range = st.slider("Date range", first_day, last_day, (first_day, last_day), format="DD MMM YYYY")
+        variables = st.multiselect("Variables", correlations.columns, default=correlations.columns)
+
+        with instrument.stage('correlations.matrix'):
+            matrix = page_result('correlations.matrix', correlation_matrix_job, method=method.lower(),
+                                 level='daily' if level == "Participant-daily" else 'participant', lag=lag,
+                                 date_range=date_range, variables=tuple(variables), version=version)
+        heatmap = alt.Chart(matrix).mark_rect().encode(
+            x=alt.X('x:N', sort=variables, axis=alt.Axis(title=f"Day t - {lag}" if lag else None, labelLimit=250)),
+            y=alt.Y('y:N', sort=variables, axis=alt.Axis(title="Day t" if lag else None, labelLimit=250)),
+            color=alt.Color('r:Q', scale=alt.Scale(scheme='redblue', domain=[-1, 1]), legend=alt.Legend(title='r')),
+            tooltip=['x', 'y', alt.Tooltip('r:Q', format='.2f'), 'n']).properties(height=800)
+        with instrument.stage('correlations.send_chart'):
+            st.altair_chart(instrument.payload('correlations.chart', heatmap), use_container_width=True)
 
 if choose == "Contact":
     email1 = "kara.christi91@gmail.com"
@@ -485,3 +560,13 @@ footer = """
 </style>
 """
 st.markdown(footer, unsafe_allow_html=True)
+
+if session_id is not None:
+    # cancels what this session waited for in earlier reruns and no longer asks for, unless others still do
+    jobs.release(session_id, keep=requested_jobs)
+
+profile = instrument.finish(f"{choose}/{selected}" if choose == "Interactive visualizations" else choose)
+if profile is not None:
+    with st.sidebar.expander("Debug: rerun timings"):
+        st.metric("Rerun", f"{profile.seconds * 1000:.0f} ms")
+        st.dataframe(profile.summary())
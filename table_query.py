@@ -0,0 +1,145 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+from data_store import DATA_PATH, data_version, load_dataframe
+from schema import DERIVED_COLUMNS
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+# columns with fewer distinct values are filtered by picking values, like dataframe_explorer does
+MAX_PICK_VALUES = 10
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+class TableIndex:
+    """Sorted (id, date) and date positions over a frame, for filtering and paging rows.
+
+    Filters on `id` and `date` are resolved by binary search on the sorted
+    positions; only the rows those leave are copied and checked against the
+    other column filters.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        ids = frame['id'].astype('category')
+        self.ids = list(ids.cat.categories)
+        codes = ids.cat.codes.to_numpy()
+        dates = frame['date'].to_numpy()
+
+        # rows ordered by id, then date; rows of the i-th id are order[bounds[i]:bounds[i + 1]]
+        self.order = np.lexsort((dates, codes))
+        self.bounds = np.searchsorted(codes[self.order], np.arange(len(self.ids) + 1))
+        self.order_dates = dates[self.order]
+
+        # rows ordered by date alone, for date filters without ids
+        self.date_order = np.argsort(dates, kind='stable')
+        self.sorted_dates = dates[self.date_order]
+
+        self.filter_kinds = {col: self._filter_kind(frame[col]) for col in frame.columns}
+
+    @staticmethod
+    def _filter_kind(values):
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.nunique() < MAX_PICK_VALUES:
+            return 'in', list(values.dropna().unique())
+        if is_numeric_dtype(values):
+            return 'range', (float(values.min()), float(values.max()))
+        if is_datetime64_any_dtype(values):
+            return 'dates', (values.min().date(), values.max().date())
+        return 'contains', None
+
+    def positions(self, ids=None, date_range=None):
+        """Return the row positions of `ids` (all by default) within `date_range`."""
+        lo, hi = self._date_bounds(date_range)
+        if not ids:
+            start, stop = np.searchsorted(self.sorted_dates, [lo, hi], side='left')
+            return np.sort(self.date_order[start:stop])
+        slices = []
+        for code in pd.Index(self.ids).get_indexer(ids):
+            if code < 0:
+                continue
+            first, last = self.bounds[code], self.bounds[code + 1]
+            start, stop = first + np.searchsorted(self.order_dates[first:last], [lo, hi], side='left')
+            slices.append(self.order[start:stop])
+        return np.sort(np.concatenate(slices)) if slices else np.array([], dtype=np.intp)
+
+    def _date_bounds(self, date_range):
+        if not date_range:
+            return self.sorted_dates[0], self.sorted_dates[-1] + np.timedelta64(1, 'ns')
+        start, end = date_range
+        # the end date is inclusive
+        return (np.datetime64(pd.Timestamp(start), 'ns'),
+                np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1), 'ns'))
+
+    def select(self, ids=None, date_range=None, filters=None, sort_by=None, ascending=True, case=False):
+        """Return the rows matching the filters, sorted by `sort_by` if given.
+
+        `filters` maps column names to the value of their filter: a list of values
+        for 'in' columns, a (low, high) pair for 'range' and 'dates' columns, a
+        text pattern for 'contains' columns.
+        """
+        rows = self.frame.take(self.positions(ids, date_range))
+        for col, value in (filters or {}).items():
+            kind = self.filter_kinds[col][0]
+            if kind == 'in':
+                rows = rows[rows[col].isin(value)]
+            elif kind == 'range':
+                rows = rows[rows[col].between(*value)]
+            elif kind == 'dates' and len(value) == 2:
+                rows = rows[rows[col].between(pd.Timestamp(value[0]), pd.Timestamp(value[1]))]
+            elif kind == 'contains' and value:
+                rows = rows[rows[col].astype('str').str.contains(value, case=case, regex=False)]
+        if sort_by is not None:
+            rows = rows.sort_values(sort_by, ascending=ascending, kind='stable')
+        return rows
+
+
+class ParticipantIndex:
+    """Frame sorted by (id, date) with the row range of every participant.
+
+    Selecting a participant is a slice of the sorted frame instead of a mask
+    over all rows.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame.sort_values(['id', 'date'], kind='stable')
+        ids = self.frame['id'].astype('category')
+        self.ids = list(ids.cat.categories)
+        self.bounds = np.searchsorted(ids.cat.codes.to_numpy(), np.arange(len(self.ids) + 1))
+        self._codes = pd.Index(self.ids)
+
+    def rows(self, ids):
+        """Return the rows of the participants `ids`, in (id, date) order."""
+        slices = [self.frame.iloc[self.bounds[code]:self.bounds[code + 1]]
+                  for code in self._codes.get_indexer(list(ids)) if code >= 0]
+        if len(slices) == 1:
+            return slices[0]
+        return pd.concat(slices) if slices else self.frame.iloc[:0]
+
+
+def load_participant_index(columns, path=DATA_PATH):
+    """Return the ParticipantIndex of `columns` (plus id and date) of the frame at `path`."""
+    columns = tuple(dict.fromkeys(['id', 'date'] + list(columns)))
+    version = data_version(path)
+    with _lock:
+        cached = _indexes.get((path, columns))
+        if cached is None or cached[0] != version:
+            cached = (version, ParticipantIndex(load_dataframe(list(columns), path=path)))
+            _indexes[(path, columns)] = cached
+        return cached[1]
+
+
+def load_table_index(path=DATA_PATH):
+    """Return the TableIndex of the stored columns of the frame at `path`, rebuilt when the data changes."""
+    version = data_version(path)
+    with _lock:
+        cached = _indexes.get(path)
+        if cached is None or cached[0] != version:
+            columns = [col for col in load_dataframe(path=path).columns if col not in DERIVED_COLUMNS]
+            cached = (version, TableIndex(load_dataframe(columns, path=path)))
+            _indexes[path] = cached
+        return cached[1]